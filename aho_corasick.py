@@ -0,0 +1,71 @@
+from collections import deque
+
+
+class AhoCorasick(object):
+    # Multi-pattern scanner over the keys of a TrieMap. Failure and output
+    # links are kept in dicts keyed by the trie's own nodes, so the trie is
+    # shared rather than copied; rebuild the scanner after changing the
+    # trie.
+
+    def __init__(self, trie):
+        self._root = trie._root
+        self._fail = {}   # node -> node for its longest proper suffix
+        self._out = {}    # node -> nearest terminal node among its suffixes
+        self._keys = {}   # terminal node -> key
+        self._build()
+
+    def _build(self):
+        root = self._root
+        fail = self._fail
+        out = self._out
+
+        queue = deque()
+        for c, child in root._children.items():
+            fail[child] = root
+            queue.append((child, c))
+
+        while queue:
+            node, key = queue.popleft()
+            if node._terminal:
+                self._keys[node] = key
+
+            for c, child in node._children.items():
+                suffix = fail[node]
+                while suffix is not root and c not in suffix._children:
+                    suffix = fail[suffix]
+
+                target = suffix._children.get(c, root)
+                fail[child] = target
+                out[child] = target if target._terminal else out.get(target)
+                queue.append((child, key + c))
+
+    def scan(self, chunks):
+        # Yields (offset, key, value) for every occurrence of every key in
+        # the concatenation of chunks, in order of where the match ends;
+        # offset is where the match starts in the whole stream. The state
+        # carries over between chunks, so matches may span them. bytes
+        # chunks are read as latin-1, one character per byte, so offsets
+        # stay byte offsets.
+        root = self._root
+        fail = self._fail
+        out = self._out
+        keys = self._keys
+
+        node = root
+        pos = 0
+        for chunk in chunks:
+            if isinstance(chunk, (bytes, bytearray, memoryview)):
+                chunk = bytes(chunk).decode('latin-1')
+
+            for c in chunk:
+                while node is not root and c not in node._children:
+                    node = fail[node]
+                node = node._children.get(c, root)
+
+                match = node if node._terminal else out.get(node)
+                while match is not None:
+                    key = keys[match]
+                    yield (pos - len(key) + 1, key, match._value)
+                    match = out.get(match)
+
+                pos += 1
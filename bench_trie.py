@@ -0,0 +1,418 @@
+import argparse
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from collections import deque
+from random import Random
+
+from radix_trie import RadixTrieMap
+from trie import TrieMap
+
+
+def _legacy_child_key_after(node, key_ord=0):
+    if len(node._children) == 0:
+        return None
+
+    cur_min_ord = key_ord
+    for child_key in node._children:
+        child_key_ord = ord(child_key)
+        if child_key_ord <= key_ord:
+            continue
+
+        if child_key_ord < cur_min_ord or cur_min_ord in (0, key_ord):
+            cur_min_ord = child_key_ord
+
+    return None if cur_min_ord == key_ord else chr(cur_min_ord)
+
+
+def _legacy_node_key(trie, node):
+    key = deque()
+    while node is not trie._root:
+        key.appendleft(node._char)
+        node = node._parent
+
+    return ''.join(key)
+
+
+def _legacy_next_node(trie, cur_node):
+    if len(cur_node._children) != 0:
+        first_child_key = _legacy_child_key_after(cur_node, 0)
+        return cur_node._children[first_child_key]
+
+    while cur_node is not trie._root:
+        parent = cur_node._parent
+        next_key = _legacy_child_key_after(parent, ord(cur_node._char))
+        if next_key is not None:
+            return parent._children[next_key]
+
+        cur_node = parent
+
+    return None
+
+
+def legacy_items(trie):
+    # The parent-pointer traversal TrieMap used before _walk, kept here so
+    # the two can be compared on the same trie.
+    cur_node = trie._root
+    while cur_node is not None:
+        if cur_node._terminal:
+            yield (_legacy_node_key(trie, cur_node), cur_node._value)
+
+        cur_node = _legacy_next_node(trie, cur_node)
+
+
+def random_keys(num_keys, seed=0, alphabet='abcdefghijklmnopqrstuvwxyz',
+                min_len=3, max_len=12):
+    rng = Random(seed)
+    keys = set()
+    while len(keys) < num_keys:
+        length = rng.randint(min_len, max_len)
+        keys.add(''.join(rng.choice(alphabet) for _ in range(length)))
+
+    return list(keys)
+
+
+def path_keys(num_keys, seed=0, alphabet='abcdefghijklmnopqrstuvwxyz'):
+    # URL/file-path shaped keys: a few shared directory levels followed by
+    # long unbranched file names.
+    rng = Random(seed)
+    dirs = [''.join(rng.choice(alphabet) for _ in range(8))
+            for _ in range(16)]
+    keys = set()
+    while len(keys) < num_keys:
+        parts = [rng.choice(dirs) for _ in range(rng.randint(1, 4))]
+        parts.append(''.join(rng.choice(alphabet) for _ in range(20)))
+        keys.add('/' + '/'.join(parts))
+
+    return list(keys)
+
+
+def dictionary_keys(num_keys, seed=0):
+    # Word-list shaped keys: stems built from syllables, most of them with
+    # several inflected forms, so keys share prefixes the way real
+    # vocabularies do rather than uniformly at random.
+    rng = Random(seed)
+    onsets = ['', 'b', 'br', 'c', 'ch', 'cl', 'd', 'f', 'fr', 'g', 'gr', 'h',
+              'k', 'l', 'm', 'n', 'p', 'pl', 'r', 's', 'sh', 'st', 't', 'tr',
+              'v', 'w']
+    vowels = ['a', 'e', 'i', 'o', 'u', 'ea', 'ou', 'ai']
+    codas = ['', '', 'n', 'r', 's', 't', 'l', 'nd', 'ck', 'st']
+    suffixes = ['', 's', 'ed', 'ing', 'er', 'ers', 'ly', 'ness', 'able']
+
+    keys = {}
+    while len(keys) < num_keys:
+        stem = ''.join(rng.choice(onsets) + rng.choice(vowels) +
+                       rng.choice(codas)
+                       for _ in range(rng.randint(1, 3)))
+        for suffix in rng.sample(suffixes, rng.randint(1, 4)):
+            keys[stem + suffix] = None
+
+    return list(keys)[:num_keys]
+
+
+def _time(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _drain(iterable):
+    for _ in iterable:
+        pass
+
+
+WIDE_ALPHABET = ''.join(chr(i) for i in range(0x400, 0x4c8))
+
+
+def bench_iteration(num_keys, alphabet, label):
+    trie = TrieMap()
+    for key in random_keys(num_keys, alphabet=alphabet):
+        trie[key] = key
+
+    assert list(trie.items()) == list(legacy_items(trie))
+
+    legacy = _time(lambda: _drain(legacy_items(trie)))
+    current = _time(lambda: _drain(trie.items()))
+    print("{:>6} {:>9} keys  legacy: {:8.3f}s  walk: {:8.3f}s  "
+          "speedup: {:6.1f}x"
+          .format(label, num_keys, legacy, current, legacy / current))
+
+
+def bench_memory(num_keys, alphabet, label):
+    keys = random_keys(num_keys, alphabet=alphabet)
+    results = []
+    for compact in (False, True):
+        tracemalloc.start()
+        trie = TrieMap(compact=compact)
+        for key in keys:
+            trie[key] = None
+
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(used / num_keys)
+        del trie
+
+    print("{:>6} {:>9} keys  default: {:8.1f} B/key  compact: {:8.1f} B/key"
+          .format(label, num_keys, results[0], results[1]))
+
+
+def bench_radix(num_keys, alphabet, label):
+    keys = path_keys(num_keys, alphabet=alphabet)
+    for trie_cls in (TrieMap, RadixTrieMap):
+        tracemalloc.start()
+        trie = trie_cls()
+        for key in keys:
+            trie[key] = None
+
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        def lookup():
+            for key in keys:
+                trie[key]
+
+        print("{:>6} {:>9} keys  {:>12}: {:8.1f} B/key  lookup: {:8.3f}s"
+              .format(label, num_keys, trie_cls.__name__, used / num_keys,
+                      _time(lookup)))
+
+
+def bench_bulk_load(num_keys, alphabet, label):
+    pairs = sorted((key, None) for key in random_keys(num_keys,
+                                                      alphabet=alphabet))
+
+    def insert_loop():
+        trie = TrieMap()
+        for key, value in pairs:
+            trie[key] = value
+
+    loop = _time(insert_loop)
+    bulk = _time(lambda: TrieMap.from_sorted(iter(pairs)))
+    paused = _time(lambda: TrieMap.from_sorted(iter(pairs), pause_gc=True))
+    print("{:>6} {:>9} keys  __setitem__: {:8.3f}s  from_sorted: {:8.3f}s  "
+          "with pause_gc: {:8.3f}s  speedup: {:6.1f}x / {:6.1f}x"
+          .format(label, num_keys, loop, bulk, paused, loop / bulk,
+                  loop / paused))
+
+
+def bench_get_many(num_keys, alphabet, label):
+    # Request-sized batches: a few hundred keys, mostly hits, drawn from a
+    # handful of neighbouring prefixes as a handler would look them up.
+    keys = sorted(path_keys(num_keys, alphabet=alphabet))
+    trie = TrieMap.from_sorted((key, key) for key in keys)
+    rng = Random(1)
+    batches = []
+    for _ in range(200):
+        start = rng.randrange(len(keys))
+        batch = keys[start:start + 200]
+        batch += [key + '~' for key in batch[:50]]
+        rng.shuffle(batch)
+        batches.append(batch)
+
+    def lookup_loop():
+        for batch in batches:
+            results = []
+            for key in batch:
+                try:
+                    results.append(trie[key])
+                except KeyError:
+                    results.append(None)
+
+    def lookup_batched():
+        for batch in batches:
+            trie.get_many(batch)
+
+    loop = _time(lookup_loop)
+    batched = _time(lookup_batched)
+    print("{:>6} {:>9} keys  __getitem__: {:8.3f}s  get_many: {:8.3f}s  "
+          "speedup: {:6.1f}x"
+          .format(label, num_keys, loop, batched, loop / batched))
+
+
+KEY_SETS = {
+    'synthetic': random_keys,
+    'dictionary': dictionary_keys,
+    'paths': path_keys,
+}
+
+TRIE_KINDS = {
+    'default': lambda: TrieMap(),
+    'compact': lambda: TrieMap(compact=True),
+}
+
+
+def _best_of(fn, repeat):
+    # Best of repeat runs, with cyclic GC paused as timeit does, so a
+    # collection landing in one run does not decide the result.
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            times.append(_time(fn))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    return min(times)
+
+
+def _suite_case(keys, misses, prefixes, new_trie, repeat):
+    # Seconds for each hot path on one key set, plus bytes per key.
+    def insert():
+        trie = new_trie()
+        for key in keys:
+            trie[key] = key
+
+    trie = new_trie()
+    for key in keys:
+        trie[key] = key
+
+    def lookup_hit():
+        for key in keys:
+            trie[key]
+
+    def lookup_miss():
+        for key in misses:
+            key in trie
+
+    def prefix_iteration():
+        for prefix in prefixes:
+            _drain(trie.with_prefix(prefix))
+
+    results = {
+        'insert': _best_of(insert, repeat),
+        'lookup_hit': _best_of(lookup_hit, repeat),
+        'lookup_miss': _best_of(lookup_miss, repeat),
+        'iteration': _best_of(lambda: _drain(trie.items()), repeat),
+        'prefix_iteration': _best_of(prefix_iteration, repeat),
+    }
+    del trie
+
+    gc.collect()
+    tracemalloc.start()
+    trie = new_trie()
+    for key in keys:
+        trie[key] = None
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['bytes_per_key'] = used / len(keys)
+
+    return results
+
+
+def run_suite(sizes, seed=0, repeat=3, key_sets=None, kinds=None):
+    # Every key set is generated from seed and inserted in a seeded
+    # shuffled order, so two runs with the same arguments do the same
+    # work. Returns a JSON-ready dict; times are in seconds.
+    report = {
+        'python': platform.python_implementation(),
+        'python_version': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': [],
+    }
+
+    for key_set in key_sets or sorted(KEY_SETS):
+        for size in sizes:
+            rng = Random(seed)
+            keys = sorted(KEY_SETS[key_set](size, seed=seed))
+            rng.shuffle(keys)
+            # Misses share the keys' prefixes and fall off at the end.
+            misses = [key + '\x00' for key in keys]
+            prefixes = sorted({key[:2] for key in keys})
+            prefixes = rng.sample(prefixes, min(len(prefixes), 50))
+
+            for kind in kinds or sorted(TRIE_KINDS):
+                case = _suite_case(keys, misses, prefixes, TRIE_KINDS[kind],
+                                   repeat)
+                case.update(key_set=key_set, size=size, trie=kind)
+                report['results'].append(case)
+                print("{:>10} {:>8} {:>8}  insert: {:7.3f}s  "
+                      "hit: {:7.3f}s  miss: {:7.3f}s  iter: {:7.3f}s  "
+                      "prefix: {:7.3f}s  {:7.1f} B/key"
+                      .format(key_set, size, kind, case['insert'],
+                              case['lookup_hit'], case['lookup_miss'],
+                              case['iteration'], case['prefix_iteration'],
+                              case['bytes_per_key']))
+
+    return report
+
+
+SUITE_METRICS = ('insert', 'lookup_hit', 'lookup_miss', 'iteration',
+                 'prefix_iteration', 'bytes_per_key')
+
+
+def compare_reports(baseline, current):
+    # Ratio current / baseline for every metric of every case found in
+    # both reports; above 1 means the current run is slower or larger.
+    def index(report):
+        return {(case['key_set'], case['size'], case['trie']): case
+                for case in report['results']}
+
+    old = index(baseline)
+    for case_key, case in sorted(index(current).items()):
+        if case_key not in old:
+            continue
+
+        ratios = ["{}: {:5.2f}x".format(metric,
+                                        case[metric] / old[case_key][metric])
+                  for metric in SUITE_METRICS if old[case_key][metric]]
+        print("{:>10} {:>8} {:>8}  {}".format(case_key[0], case_key[1],
+                                              case_key[2], '  '.join(ratios)))
+
+
+BENCHMARKS = {
+    'iteration': bench_iteration,
+    'memory': bench_memory,
+    'radix': bench_radix,
+    'bulk': bench_bulk_load,
+    'batch': bench_get_many,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for TrieMap. 'suite' times the hot paths "
+                    "on every key set and can write the results as JSON; "
+                    "the others compare one optimization against what it "
+                    "replaced.")
+    parser.add_argument('benchmark', nargs='?', default='suite',
+                        choices=['suite'] + sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--key-set', action='append',
+                        choices=sorted(KEY_SETS))
+    parser.add_argument('--trie', action='append',
+                        choices=sorted(TRIE_KINDS))
+    parser.add_argument('--output', help="write suite results to this JSON "
+                                         "file")
+    parser.add_argument('--compare', help="suite results from an earlier "
+                                          "run to compare against")
+    args = parser.parse_args(argv)
+
+    if args.benchmark != 'suite':
+        for size in args.sizes:
+            BENCHMARKS[args.benchmark](size, 'abcdefghijklmnopqrstuvwxyz',
+                                       'ascii')
+            BENCHMARKS[args.benchmark](size, WIDE_ALPHABET, 'wide')
+        return
+
+    report = run_suite(args.sizes, args.seed, args.repeat, args.key_set,
+                       args.trie)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_reports(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
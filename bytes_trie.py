@@ -0,0 +1,243 @@
+from bisect import bisect_left
+
+# A node switches from a sorted label string to a 256-slot array once it
+# has this many children, and back again when it drops to half.
+_WIDE_FANOUT = 32
+
+_BYTES_TYPES = (bytes, bytearray, memoryview)
+
+
+class _BytesNode(object):
+    # Children are either "narrow": _labels is a sorted bytes object and
+    # _children the parallel list of nodes, searched with bytes.find; or
+    # "wide": _labels is None and _children has 256 slots indexed directly
+    # by the byte value.
+    __slots__ = ('_labels', '_children', '_value', '_terminal')
+
+    def __init__(self):
+        self._labels = b''
+        self._children = []
+        self._value = None
+        self._terminal = False
+
+    def __repr__(self):
+        return ("[ [ terminal: {} ] "
+                "[ value: {} ] "
+                "[ children: {} ] ]".format(self._terminal,
+                                            self._value,
+                                            [b for b, _ in self.items()]))
+
+    def get(self, byte):
+        labels = self._labels
+        if labels is None:
+            return self._children[byte]
+
+        i = labels.find(byte)
+        return None if i < 0 else self._children[i]
+
+    def items(self):
+        if self._labels is None:
+            return [(b, child) for b, child in enumerate(self._children)
+                    if child is not None]
+
+        return list(zip(self._labels, self._children))
+
+    def num_children(self):
+        if self._labels is None:
+            return len(self._children) - self._children.count(None)
+
+        return len(self._children)
+
+    def add_child(self, byte):
+        child = _BytesNode()
+        labels = self._labels
+        if labels is None:
+            self._children[byte] = child
+            return child
+
+        if len(labels) + 1 >= _WIDE_FANOUT:
+            wide = [None] * 256
+            for b, node in zip(labels, self._children):
+                wide[b] = node
+            wide[byte] = child
+            self._labels = None
+            self._children = wide
+            return child
+
+        i = bisect_left(labels, byte)
+        self._labels = labels[:i] + bytes((byte,)) + labels[i:]
+        self._children.insert(i, child)
+        return child
+
+    def remove_child(self, byte):
+        if self._labels is not None:
+            i = self._labels.find(byte)
+            self._labels = self._labels[:i] + self._labels[i + 1:]
+            del self._children[i]
+            return
+
+        self._children[byte] = None
+        if self.num_children() <= _WIDE_FANOUT // 2:
+            pairs = self.items()
+            self._labels = bytes(b for b, _ in pairs)
+            self._children = [node for _, node in pairs]
+
+
+def _check_key(key):
+    if not isinstance(key, _BYTES_TYPES):
+        raise TypeError("Keys must be bytes-like, not {}"
+                        .format(type(key).__name__))
+
+    if isinstance(key, memoryview) and key.format != 'B':
+        key = key.cast('B')
+
+    return key
+
+
+class BytesTrieMap(object):
+    # A trie map over bytes keys. bytes, bytearray and memoryview keys are
+    # walked byte by byte as ints, so lookups can come straight from
+    # network buffers without decoding; keys come back out as bytes.
+
+    def __init__(self):
+        self._root = _BytesNode()
+        self._num_elements = 0
+
+    def __len__(self):
+        return self._num_elements
+
+    def _find(self, key):
+        cur_node = self._root
+        for b in key:
+            labels = cur_node._labels
+            if labels is None:
+                cur_node = cur_node._children[b]
+                if cur_node is None:
+                    return None
+            else:
+                i = labels.find(b)
+                if i < 0:
+                    return None
+                cur_node = cur_node._children[i]
+
+        return cur_node
+
+    def __getitem__(self, key):
+        key = _check_key(key)
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        node = self._find(key)
+        if node is None or not node._terminal:
+            raise KeyError("Key {} not found.".format(bytes(key)))
+
+        return node._value
+
+    def get(self, key, default=None):
+        key = _check_key(key)
+        node = self._find(key) if len(key) != 0 else None
+        if node is None or not node._terminal:
+            return default
+
+        return node._value
+
+    def __contains__(self, key):
+        key = _check_key(key)
+        node = self._find(key) if len(key) != 0 else None
+        return node is not None and node._terminal
+
+    def __setitem__(self, key, value):
+        key = _check_key(key)
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        cur_node = self._root
+        for b in key:
+            child = cur_node.get(b)
+            if child is None:
+                child = cur_node.add_child(b)
+            cur_node = child
+
+        if not cur_node._terminal:
+            self._num_elements += 1
+
+        cur_node._terminal = True
+        cur_node._value = value
+
+    def __delitem__(self, key):
+        key = _check_key(key)
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        path = [self._root]
+        for b in key:
+            child = path[-1].get(b)
+            if child is None:
+                raise KeyError("Key {} not found.".format(bytes(key)))
+            path.append(child)
+
+        node = path[-1]
+        if not node._terminal:
+            raise KeyError("Key {} not found.".format(bytes(key)))
+
+        node._terminal = False
+        node._value = None
+        self._num_elements -= 1
+
+        depth = len(key)
+        while depth > 0:
+            node = path[depth]
+            if node._terminal or node.num_children():
+                break
+
+            path[depth - 1].remove_child(key[depth - 1])
+            depth -= 1
+
+    def _walk(self, node, prefix):
+        path = bytearray(prefix)
+        if node._terminal:
+            yield bytes(path), node
+
+        stack = [iter(node.items())]
+        while stack:
+            for byte, child in stack[-1]:
+                path.append(byte)
+                if child._terminal:
+                    yield bytes(path), child
+
+                if child.num_children():
+                    stack.append(iter(child.items()))
+                else:
+                    path.pop()
+                break
+            else:
+                stack.pop()
+                if stack:
+                    path.pop()
+
+    def __iter__(self):
+        for key, _ in self._walk(self._root, b''):
+            yield key
+
+    def items(self):
+        for key, node in self._walk(self._root, b''):
+            yield (key, node._value)
+
+    def with_prefix(self, prefix=None):
+        prefix = _check_key(prefix or b'')
+        node = self._find(prefix)
+        if node is None:
+            return
+
+        for key, node in self._walk(node, prefix):
+            yield (key, node._value)
+
+    def __str__(self):
+        output = "{"
+        for key, value in self.items():
+            output += "{}: {}, ".format(key, value)
+        output += "}"
+        return output
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,230 @@
+from threading import Lock
+
+
+class _CowNode(object):
+    # Nodes reachable from a published root are never modified. A writer
+    # copies every node on the path it changes and may only edit the
+    # copies it made itself.
+    __slots__ = ('_children', '_value', '_terminal', '_count')
+
+    def __init__(self, children=None, value=None, terminal=False, count=0):
+        self._children = {} if children is None else children
+        self._value = value
+        self._terminal = terminal
+        self._count = count
+
+
+class TrieSnapshot(object):
+    # Read-only view of a ConcurrentTrieMap as of one published root.
+    # Every read loads the root once, so it sees one consistent version no
+    # matter what the writer does meanwhile.
+
+    def __init__(self, root):
+        self._root = root
+
+    def __len__(self):
+        return self._root._count
+
+    def _find(self, key):
+        cur_node = self._root
+        for c in key:
+            cur_node = cur_node._children.get(c)
+            if cur_node is None:
+                return None
+
+        return cur_node
+
+    def __getitem__(self, key):
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        node = self._find(key)
+        if node is None or not node._terminal:
+            raise KeyError("Key {} not found.".format(key))
+
+        return node._value
+
+    def get(self, key, default=None):
+        node = self._find(key) if len(key) != 0 else None
+        if node is None or not node._terminal:
+            return default
+
+        return node._value
+
+    def __contains__(self, key):
+        node = self._find(key) if len(key) != 0 else None
+        return node is not None and node._terminal
+
+    def _walk(self, node, prefix):
+        path = list(prefix)
+        if node._terminal:
+            yield prefix, node
+
+        stack = [iter(sorted(node._children.items()))]
+        while stack:
+            for char, child in stack[-1]:
+                path.append(char)
+                if child._terminal:
+                    yield ''.join(path), child
+
+                if child._children:
+                    stack.append(iter(sorted(child._children.items())))
+                else:
+                    path.pop()
+                break
+            else:
+                stack.pop()
+                if stack:
+                    path.pop()
+
+    def __iter__(self):
+        for key, _ in self._walk(self._root, ''):
+            yield key
+
+    def items(self):
+        for key, node in self._walk(self._root, ''):
+            yield (key, node._value)
+
+    def with_prefix(self, prefix=None):
+        node = self._find(prefix or '')
+        if node is None:
+            return
+
+        for key, node in self._walk(node, prefix or ''):
+            yield (key, node._value)
+
+    def __str__(self):
+        output = "{"
+        for key, value in self.items():
+            output += "{}: {}, ".format(key, value)
+        output += "}"
+        return output
+
+    def __repr__(self):
+        return str(self)
+
+
+class TrieWriteBatch(object):
+    # A group of writes published as one new version when the with block
+    # exits normally, and dropped if it raises. Holds the writer lock for
+    # the duration; readers are never blocked.
+
+    def __init__(self, trie):
+        self._trie = trie
+        self._root = None
+        self._fresh = None   # nodes copied by this batch, safe to edit
+
+    def __enter__(self):
+        self._trie._write_lock.acquire()
+        self._root = self._trie._root
+        self._fresh = set()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._trie._root = self._root
+        finally:
+            self._root = None
+            self._fresh = None
+            self._trie._write_lock.release()
+
+    def _copy(self, node):
+        if node in self._fresh:
+            return node
+
+        copy = _CowNode(dict(node._children), node._value, node._terminal,
+                        node._count)
+        self._fresh.add(copy)
+        return copy
+
+    def __getitem__(self, key):
+        return TrieSnapshot(self._root)[key]
+
+    def __contains__(self, key):
+        return key in TrieSnapshot(self._root)
+
+    def __setitem__(self, key, value):
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        cur_node = self._copy(self._root)
+        path = [cur_node]
+        for c in key:
+            child = cur_node._children.get(c)
+            if child is None:
+                child = _CowNode()
+                self._fresh.add(child)
+            else:
+                child = self._copy(child)
+
+            cur_node._children[c] = child
+            cur_node = child
+            path.append(cur_node)
+
+        if not cur_node._terminal:
+            for node in path:
+                node._count += 1
+
+        cur_node._terminal = True
+        cur_node._value = value
+        self._root = path[0]
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError("Key {} not found.".format(key))
+
+        cur_node = self._copy(self._root)
+        path = [cur_node]
+        for c in key:
+            child = self._copy(cur_node._children[c])
+            cur_node._children[c] = child
+            cur_node = child
+            path.append(cur_node)
+
+        for node in path:
+            node._count -= 1
+        cur_node._terminal = False
+        cur_node._value = None
+
+        # Drop nodes that no longer lead to any key.
+        depth = len(key)
+        while depth > 0:
+            node = path[depth]
+            if node._terminal or node._children:
+                break
+
+            del path[depth - 1]._children[key[depth - 1]]
+            depth -= 1
+
+        self._root = path[0]
+
+
+class ConcurrentTrieMap(TrieSnapshot):
+    # A trie map for many reader threads and one writer at a time. Writes
+    # copy the nodes along the changed path and publish the new root with
+    # a single reference assignment, so reads never take a lock and never
+    # see a half-applied change.
+
+    def __init__(self):
+        TrieSnapshot.__init__(self, _CowNode())
+        self._write_lock = Lock()
+
+    def snapshot(self):
+        return TrieSnapshot(self._root)
+
+    def batch(self):
+        return TrieWriteBatch(self)
+
+    def __setitem__(self, key, value):
+        with self.batch() as batch:
+            batch[key] = value
+
+    def __delitem__(self, key):
+        with self.batch() as batch:
+            del batch[key]
+
+    def update(self, pairs):
+        with self.batch() as batch:
+            for key, value in pairs:
+                batch[key] = value
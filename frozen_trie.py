@@ -0,0 +1,238 @@
+import mmap
+import pickle
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+# File layout, every section padded to 8 bytes:
+#
+#   header        magic, version, byte order, node count, value count
+#   labels        uint32[nodes]     code point on the edge into each node
+#   first_child   uint32[nodes]     index of the node's first child
+#   num_children  uint32[nodes]
+#   value_index   int64[nodes]      index into the value table, -1 if none
+#   value_offsets uint64[values+1]  offsets of the pickled values
+#   values        pickled values, back to back
+#
+# Nodes are laid out breadth first, so the children of a node occupy one
+# contiguous run of indices sorted by label and a lookup is one binary
+# search per key character. Node 0 is the root.
+
+_MAGIC = b'FROZTRIE'
+_VERSION = 1
+_HEADER = struct.Struct('<8sIIQQ')
+
+
+def _padded(data):
+    return data + b'\0' * (-len(data) % 8)
+
+
+class FrozenTrieMap(object):
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        self._views = []
+        self._open_views()
+
+    def _open_views(self):
+        buf = memoryview(self._mmap)
+        self._views.append(buf)
+
+        if len(buf) < _HEADER.size:
+            self.close()
+            raise ValueError("Not a frozen trie file")
+
+        magic, version, little, num_nodes, num_values = \
+            _HEADER.unpack_from(buf)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError("Not a frozen trie file")
+
+        if bool(little) != (sys.byteorder == 'little'):
+            self.close()
+            raise ValueError("Frozen trie was written with a different "
+                             "byte order")
+
+        offset = _HEADER.size
+
+        def section(fmt, itemsize, count):
+            nonlocal offset
+            size = itemsize * count
+            view = buf[offset:offset + size].cast(fmt)
+            self._views.append(view)
+            offset += size + (-size % 8)
+            return view
+
+        self._labels = section('I', 4, num_nodes)
+        self._first_child = section('I', 4, num_nodes)
+        self._num_children = section('I', 4, num_nodes)
+        self._value_index = section('q', 8, num_nodes)
+        self._value_offsets = section('Q', 8, num_values + 1)
+        self._values = buf[offset:]
+        self._views.append(self._values)
+        self._num_elements = num_values
+
+    def close(self):
+        if self._mmap is None:
+            return
+
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+        self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._num_elements
+
+    def _find(self, key):
+        labels = self._labels
+        first_child = self._first_child
+        num_children = self._num_children
+
+        node = 0
+        for c in key:
+            lo = first_child[node]
+            hi = lo + num_children[node]
+            code = ord(c)
+            node = bisect_left(labels, code, lo, hi)
+            if node == hi or labels[node] != code:
+                return -1
+
+        return node
+
+    def _value(self, value_index):
+        start = self._value_offsets[value_index]
+        end = self._value_offsets[value_index + 1]
+        return pickle.loads(self._values[start:end])
+
+    def __getitem__(self, key):
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        node = self._find(key)
+        if node < 0 or self._value_index[node] < 0:
+            raise KeyError("Key {} not found.".format(key))
+
+        return self._value(self._value_index[node])
+
+    def __contains__(self, key):
+        if len(key) == 0:
+            return False
+
+        node = self._find(key)
+        return node >= 0 and self._value_index[node] >= 0
+
+    def _walk(self, node, prefix):
+        labels = self._labels
+        first_child = self._first_child
+        num_children = self._num_children
+        value_index = self._value_index
+
+        path = list(prefix)
+        if value_index[node] >= 0:
+            yield prefix, value_index[node]
+
+        # Each stack entry is the [next, end) range of children still to
+        # visit at that depth.
+        lo = first_child[node]
+        stack = [[lo, lo + num_children[node]]]
+        while stack:
+            child_range = stack[-1]
+            if child_range[0] == child_range[1]:
+                stack.pop()
+                if stack:
+                    path.pop()
+                continue
+
+            child = child_range[0]
+            child_range[0] += 1
+            path.append(chr(labels[child]))
+            if value_index[child] >= 0:
+                yield ''.join(path), value_index[child]
+
+            if num_children[child]:
+                lo = first_child[child]
+                stack.append([lo, lo + num_children[child]])
+            else:
+                path.pop()
+
+    def __iter__(self):
+        for key, _ in self._walk(0, ''):
+            yield key
+
+    def items(self):
+        for key, value_index in self._walk(0, ''):
+            yield (key, self._value(value_index))
+
+    def with_prefix(self, prefix=None):
+        node = self._find(prefix or '')
+        if node < 0:
+            return
+
+        for key, value_index in self._walk(node, prefix or ''):
+            yield (key, self._value(value_index))
+
+    def __str__(self):
+        output = "{"
+        for key, value in self.items():
+            output += "{}: {}, ".format(key, value)
+        output += "}"
+        return output
+
+    def __repr__(self):
+        return str(self)
+
+    @staticmethod
+    def build(trie, path):
+        labels = array('I', [0])
+        first_child = array('I')
+        num_children = array('I')
+        value_index = array('q')
+        value_offsets = array('Q', [0])
+        values = []
+
+        nodes = [trie._root]
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            first_child.append(len(nodes))
+            num_children.append(len(node._children))
+            for c, child in sorted(node._children.items()):
+                nodes.append(child)
+                labels.append(ord(c))
+
+            if node._terminal:
+                value_index.append(len(values))
+                values.append(pickle.dumps(node._value,
+                                           pickle.HIGHEST_PROTOCOL))
+                value_offsets.append(value_offsets[-1] + len(values[-1]))
+            else:
+                value_index.append(-1)
+
+            nodes[i] = None
+            i += 1
+
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION,
+                                 sys.byteorder == 'little',
+                                 len(labels), len(values)))
+            for section in (labels, first_child, num_children, value_index,
+                            value_offsets):
+                f.write(_padded(section.tobytes()))
+            for value in values:
+                f.write(value)
@@ -0,0 +1,300 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+import os
+import sys
+import time
+from threading import Condition, RLock
+
+from thread_pool import (ThreadPool, ThreadPoolError, QueueFullError,
+                         _run_chunk)
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:   # Python < 3.8
+    shared_memory = None
+
+
+class _SharedArg(object):
+    # Stands in for a large bytes-like argument that was copied into a
+    # shared memory block; the worker swaps it back before the call.
+
+    def __init__(self, name, size, kind):
+        self.name = name
+        self.size = size
+        self.kind = kind
+
+    def load(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            data = bytes(block.buf[:self.size])
+        finally:
+            block.close()
+
+        if self.kind is bytearray:
+            return bytearray(data)
+        if self.kind is memoryview:
+            return memoryview(data)
+        return data
+
+
+def _run_shared(fn, args):
+    args = tuple(arg.load() if isinstance(arg, _SharedArg) else arg
+                 for arg in args)
+    return fn(*args)
+
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class ProcessPool(object):
+    # The ThreadPool lifecycle and queue bound for CPU-bound work: jobs
+    # and their arguments are pickled to a set of worker processes, so
+    # they must be picklable (module-level functions, not lambdas).
+    # initializer(*initargs) runs once in every worker as it starts; it
+    # and mp_context need Python 3.7.
+    #
+    # Bytes-like arguments of at least shm_threshold bytes go through a
+    # multiprocessing.shared_memory block instead of the pickle pipe; the
+    # job still receives the same type. Needs Python 3.8, and is skipped
+    # without it or with shm_threshold None.
+    #
+    # The queue bound counts jobs submitted but not yet started, taken as
+    # everything unfinished beyond one job per worker.
+
+    RUNNING = ThreadPool.RUNNING
+    STOPPING = ThreadPool.STOPPING
+    STOPPED = ThreadPool.STOPPED
+
+    BLOCK = ThreadPool.BLOCK
+    REJECT = ThreadPool.REJECT
+    DROP_OLDEST = ThreadPool.DROP_OLDEST
+    CALLER_RUNS = ThreadPool.CALLER_RUNS
+
+    def __init__(self, num_processes=None, queue_size=100, overload=BLOCK,
+                 block_timeout=None, initializer=None, initargs=(),
+                 shm_threshold=1 << 20, mp_context=None):
+        if queue_size is not None and queue_size < 1:
+            raise ValueError("queue_size must be at least 1, or None")
+        if overload not in (ProcessPool.BLOCK, ProcessPool.REJECT,
+                            ProcessPool.DROP_OLDEST, ProcessPool.CALLER_RUNS):
+            raise ValueError("Unknown overload policy {}".format(overload))
+        if ((initializer is not None or mp_context is not None) and
+                sys.version_info < (3, 7)):
+            raise ValueError("initializer and mp_context need Python 3.7")
+
+        self._status = ProcessPool.STOPPED
+        self._executor = None
+        self._num_processes = num_processes or os.cpu_count() or 1
+        self._max_queue_size = queue_size
+        self._overload = overload
+        self._block_timeout = block_timeout
+        self._initializer = initializer
+        self._initargs = initargs
+        self._shm_threshold = shm_threshold
+        self._mp_context = mp_context
+
+        # Re-entrant: cancelling a future runs its done callback, which
+        # takes the lock again, in the cancelling thread.
+        self._lock = RLock()
+        self._condition_not_full = Condition(self._lock)
+        self._pending = deque()   # unfinished futures, oldest first
+        self._num_pending = 0
+
+    @property
+    def status(self):
+        with self._lock:
+            return self._status
+
+    @property
+    def size(self):
+        return self._num_processes
+
+    @property
+    def overload(self):
+        return self._overload
+
+    @property
+    def queue_depth(self):
+        return max(0, self._num_pending - self._num_processes)
+
+    def start(self):
+        with self._lock:
+            if self._status == ProcessPool.RUNNING:
+                return
+
+            if self._status == ProcessPool.STOPPING:
+                raise ThreadPoolError(
+                    "Trying to start process pool while it is stopping")
+
+            # Python 3.6 has neither keyword, so they are only passed when
+            # used.
+            kwargs = {}
+            if self._mp_context is not None:
+                kwargs['mp_context'] = self._mp_context
+            if self._initializer is not None:
+                kwargs['initializer'] = self._initializer
+                kwargs['initargs'] = self._initargs
+            self._executor = ProcessPoolExecutor(self._num_processes,
+                                                 **kwargs)
+            self._status = ProcessPool.RUNNING
+
+    def stop(self):
+        # Lets the workers finish every job already submitted, then shuts
+        # them down. Submitters still waiting for room are turned away.
+        with self._lock:
+            if self._status != ProcessPool.RUNNING:
+                return
+
+            self._status = ProcessPool.STOPPING
+            self._condition_not_full.notify_all()
+            executor = self._executor
+
+        executor.shutdown(wait=True)
+
+        with self._lock:
+            self._executor = None
+            self._status = ProcessPool.STOPPED
+
+    def _share(self, args):
+        # Moves large bytes-like arguments into shared memory blocks;
+        # returns the new arguments and the blocks to free afterwards.
+        if shared_memory is None or self._shm_threshold is None:
+            return args, []
+
+        shared = []
+        blocks = []
+        try:
+            for arg in args:
+                if (isinstance(arg, (bytes, bytearray, memoryview)) and
+                        len(arg) >= self._shm_threshold):
+                    view = memoryview(arg)
+                    if view.c_contiguous:
+                        view = view.cast('B')
+                        block = shared_memory.SharedMemory(
+                            create=True, size=max(1, view.nbytes))
+                        blocks.append(block)
+                        block.buf[:view.nbytes] = view
+                        arg = _SharedArg(block.name, view.nbytes, type(arg))
+                shared.append(arg)
+        except BaseException:
+            _release(blocks)
+            raise
+
+        return tuple(shared), blocks
+
+    def _check_running(self):
+        if self._status != ProcessPool.RUNNING:
+            raise ThreadPoolError("Trying to submit jobs during pool shutdown")
+
+    def _is_full(self):
+        return (self._max_queue_size is not None and
+                self._num_pending >= self._max_queue_size +
+                self._num_processes)
+
+    def _make_room(self):
+        # Called with the lock held on a full queue. Returns True once
+        # there is room for one more job, False if the job is turned away.
+        if self._overload == ProcessPool.DROP_OLDEST:
+            # Jobs already handed to a worker cannot be cancelled; if none
+            # can be, overshoot rather than fail.
+            for future in list(self._pending):
+                if future.cancel():
+                    break
+            return True
+
+        if self._overload != ProcessPool.BLOCK:
+            return False
+
+        wait_until = None
+        if self._block_timeout is not None:
+            wait_until = time.monotonic() + self._block_timeout
+
+        while self._is_full() and self._status == ProcessPool.RUNNING:
+            if wait_until is None:
+                self._condition_not_full.wait()
+                continue
+
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._condition_not_full.wait(remaining)
+
+        return True
+
+    def _job_done(self, future):
+        with self._lock:
+            self._pending.remove(future)
+            self._num_pending -= 1
+            self._condition_not_full.notify()
+
+    def submit(self, job, *args):
+        # Runs job(*args) in a worker process and returns a
+        # concurrent.futures.Future for its result.
+        with self._lock:
+            self._check_running()
+            caller_runs = self._is_full() and not self._make_room()
+            # Waiting for room releases the lock; the pool may have stopped.
+            self._check_running()
+            if not caller_runs:
+                self._num_pending += 1
+            elif self._overload != ProcessPool.CALLER_RUNS:
+                raise QueueFullError("Queue is full")
+
+        if caller_runs:
+            future = Future()
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(job(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        blocks = []
+        try:
+            shared, blocks = self._share(args)
+            if blocks:
+                future = self._executor.submit(_run_shared, job, shared)
+                future.add_done_callback(lambda _: _release(blocks))
+            else:
+                future = self._executor.submit(job, *args)
+        except BaseException:
+            _release(blocks)
+            with self._lock:
+                self._num_pending -= 1
+                self._condition_not_full.notify()
+            raise
+
+        with self._lock:
+            self._pending.append(future)
+        future.add_done_callback(self._job_done)
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        # Like ThreadPool.map, in order only: chunks of chunksize calls
+        # are each pickled and run as one job.
+        if chunksize < 1:
+            raise ValueError("chunksize must be at least 1")
+
+        end_time = None if timeout is None else time.monotonic() + timeout
+        args = zip(*iterables)
+        futures = [self.submit(_run_chunk, fn, chunk) for chunk
+                   in iter(lambda: list(islice(args, chunksize)), [])]
+
+        def results():
+            try:
+                futures.reverse()
+                while futures:
+                    future = futures.pop()
+                    remaining = None
+                    if end_time is not None:
+                        remaining = end_time - time.monotonic()
+                    yield from future.result(remaining)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return results()
@@ -0,0 +1,224 @@
+class _RadixNode(object):
+    __slots__ = ('_label', '_children', '_value', '_terminal')
+
+    def __init__(self, label):
+        self._label = label     # characters on the edge into this node
+        self._children = {}     # first char of child label -> _RadixNode
+        self._value = None
+        self._terminal = False
+
+    def __repr__(self):
+        return ("[ [ label: {} ] "
+                "[ terminal: {} ] "
+                "[ value: {} ] "
+                "[ children: {} ] ]".format(self._label,
+                                            self._terminal,
+                                            self._value,
+                                            self._children.keys()))
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def is_terminal(self):
+        return self._terminal
+
+
+def _common_prefix_length(label, key, start):
+    limit = min(len(label), len(key) - start)
+    i = 0
+    while i < limit and label[i] == key[start + i]:
+        i += 1
+
+    return i
+
+
+class RadixTrieMap(object):
+    def __init__(self):
+        self._root = _RadixNode('')
+        self._num_elements = 0
+
+    def __len__(self):
+        return self._num_elements
+
+    def _find(self, key):
+        cur_node = self._root
+        i = 0
+        end = len(key)
+        while i != end:
+            cur_node = cur_node._children.get(key[i])
+            if cur_node is None or not key.startswith(cur_node._label, i):
+                return None
+
+            i += len(cur_node._label)
+
+        return cur_node
+
+    def __getitem__(self, key):
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        node = self._find(key)
+        if node is None or not node._terminal:
+            raise KeyError("Key {} not found.".format(key))
+
+        return node._value
+
+    def __contains__(self, key):
+        if len(key) == 0:
+            return False
+
+        node = self._find(key)
+        return node is not None and node._terminal
+
+    def __setitem__(self, key, value):
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        cur_node = self._root
+        i = 0
+        end = len(key)
+        while i != end:
+            child = cur_node._children.get(key[i])
+            if child is None:
+                child = _RadixNode(key[i:])
+                cur_node._children[key[i]] = child
+                cur_node = child
+                break
+
+            label = child._label
+            if key.startswith(label, i):
+                cur_node = child
+                i += len(label)
+                continue
+
+            # The key leaves the edge part way along: split the edge so the
+            # shared part becomes its own node.
+            split = _common_prefix_length(label, key, i)
+            middle = _RadixNode(label[:split])
+            child._label = label[split:]
+            middle._children[child._label[0]] = child
+            cur_node._children[key[i]] = middle
+            cur_node = middle
+            i += split
+
+        if not cur_node._terminal:
+            self._num_elements += 1
+
+        cur_node._terminal = True
+        cur_node._value = value
+
+    def __delitem__(self, key):
+        if len(key) == 0:
+            raise KeyError("Key may not be empty")
+
+        path = [self._root]
+        i = 0
+        end = len(key)
+        while i != end:
+            child = path[-1]._children.get(key[i])
+            if child is None or not key.startswith(child._label, i):
+                raise KeyError("Key {} not found.".format(key))
+
+            path.append(child)
+            i += len(child._label)
+
+        node = path[-1]
+        if not node._terminal:
+            raise KeyError("Key {} not found.".format(key))
+
+        node._terminal = False
+        node._value = None
+        self._num_elements -= 1
+
+        parent = path[-2]
+        if len(node._children) == 0:
+            del parent._children[node._label[0]]
+            # The parent may now be a pass-through node with one child.
+            if len(path) > 2:
+                self._merge_with_child(path[-3], parent)
+        else:
+            self._merge_with_child(parent, node)
+
+    def _merge_with_child(self, parent, node):
+        # Fold a non-terminal node with a single child into that child, so
+        # every unbranched run stays a single edge.
+        if node._terminal or len(node._children) != 1:
+            return
+
+        for child in node._children.values():
+            child._label = node._label + child._label
+            parent._children[node._label[0]] = child
+
+    def _walk(self, node, prefix):
+        # Same depth-first walk as TrieMap._walk, except that each step
+        # adds a whole edge label to the key instead of one character.
+        path = [prefix]
+        if node._terminal:
+            yield prefix, node
+
+        stack = [iter(sorted(node._children.items()))]
+        while stack:
+            for _, child in stack[-1]:
+                path.append(child._label)
+                if child._terminal:
+                    yield ''.join(path), child
+
+                if child._children:
+                    stack.append(iter(sorted(child._children.items())))
+                else:
+                    path.pop()
+                break
+            else:
+                stack.pop()
+                if stack:
+                    path.pop()
+
+    def __iter__(self):
+        for key, _ in self._walk(self._root, ''):
+            yield key
+
+    def items(self):
+        for key, node in self._walk(self._root, ''):
+            yield (key, node._value)
+
+    def with_prefix(self, prefix=None):
+        if not prefix:
+            for item in self.items():
+                yield item
+            return
+
+        cur_node = self._root
+        i = 0
+        end = len(prefix)
+        while i != end:
+            cur_node = cur_node._children.get(prefix[i])
+            if cur_node is None:
+                return
+
+            label = cur_node._label
+            if prefix.startswith(label, i):
+                i += len(label)
+                continue
+
+            # The prefix may end part way along this edge, in which case the
+            # whole subtree below the edge matches.
+            if not label.startswith(prefix[i:]):
+                return
+
+            prefix = prefix[:i] + label
+            break
+
+        for key, node in self._walk(cur_node, prefix):
+            yield (key, node._value)
+
+    def __str__(self):
+        output = "{"
+        for key, value in self.items():
+            output += "{}: {}, ".format(key, value)
+        output += "}"
+        return output
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,83 @@
+import unittest
+from random import Random
+
+from aho_corasick import AhoCorasick
+from trie import TrieMap
+
+
+def _brute_force(patterns, text):
+    matches = []
+    for end in range(len(text)):
+        for key in sorted(patterns, key=len, reverse=True):
+            start = end - len(key) + 1
+            if start >= 0 and text[start:end + 1] == key:
+                matches.append((start, key, patterns[key]))
+
+    return matches
+
+
+def _chunked(text, rng):
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(0, 7)
+        chunks.append(text[i:i + size])
+        i += size
+
+    return chunks
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_classic_example(self):
+        t = TrieMap()
+        for key in ('he', 'she', 'his', 'hers'):
+            t[key] = key.upper()
+
+        matches = list(AhoCorasick(t).scan(['ushers']))
+        self.assertEqual(matches, [(1, 'she', 'SHE'), (2, 'he', 'HE'),
+                                   (2, 'hers', 'HERS')])
+
+    def test_matches_across_chunks(self):
+        t = TrieMap(compact=True)
+        t['error'] = 1
+        t['fatal error'] = 2
+        scanner = AhoCorasick(t)
+
+        chunks = ['a fat', 'al er', 'r', 'or and error']
+        self.assertEqual(list(scanner.scan(chunks)),
+                         [(2, 'fatal error', 2), (8, 'error', 1),
+                          (18, 'error', 1)])
+
+    def test_bytes_chunks(self):
+        t = TrieMap()
+        t['GET /'] = 'get'
+        t['/admin'] = 'admin'
+        chunks = [b'GET /ad', bytearray(b'min HTTP/1.1\r\nGET '),
+                  memoryview(b'/x')]
+        self.assertEqual(list(AhoCorasick(t).scan(chunks)),
+                         [(0, 'GET /', 'get'), (4, '/admin', 'admin'),
+                          (21, 'GET /', 'get')])
+
+    def test_random_text_matches_brute_force(self):
+        rng = Random(5)
+        for compact in (False, True):
+            patterns = {}
+            t = TrieMap(compact=compact)
+            for i in range(40):
+                key = ''.join(rng.choice('abc')
+                              for _ in range(rng.randint(1, 5)))
+                patterns[key] = i
+                t[key] = i
+
+            scanner = AhoCorasick(t)
+            for _ in range(10):
+                text = ''.join(rng.choice('abcd') for _ in range(200))
+                expected = _brute_force(patterns, text)
+                self.assertEqual(list(scanner.scan(_chunked(text, rng))),
+                                 expected)
+
+    def test_empty(self):
+        self.assertEqual(list(AhoCorasick(TrieMap()).scan(['abc'])), [])
+        t = TrieMap()
+        t['a'] = 1
+        self.assertEqual(list(AhoCorasick(t).scan([])), [])
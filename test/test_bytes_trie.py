@@ -0,0 +1,75 @@
+import unittest
+from random import Random
+
+from bytes_trie import BytesTrieMap, _WIDE_FANOUT
+
+
+class TestBytesTrieMap(unittest.TestCase):
+    def test_bytes_like_keys(self):
+        t = BytesTrieMap()
+        t[b'GET'] = 1
+        t[bytearray(b'POST')] = 2
+        t[memoryview(b'PUT')] = 3
+
+        buf = bytearray(b'xxGETxx')
+        self.assertEqual(t[memoryview(buf)[2:5]], 1)
+        self.assertEqual(t[b'POST'], 2)
+        self.assertEqual(t[bytearray(b'PUT')], 3)
+        self.assertTrue(b'GET' in t)
+        self.assertFalse(b'GE' in t)
+        self.assertEqual(t.get(b'HEAD', 'none'), 'none')
+        self.assertEqual(list(t), [b'GET', b'POST', b'PUT'])
+        self.assertEqual(list(t.with_prefix(b'P')),
+                         [(b'POST', 2), (b'PUT', 3)])
+
+        with self.assertRaises(TypeError):
+            t['GET']
+        with self.assertRaises(KeyError):
+            t[b'']
+        with self.assertRaises(KeyError):
+            t[b'GE']
+
+    def test_wide_nodes(self):
+        t = BytesTrieMap()
+        for b in range(256):
+            t[bytes((b,))] = b
+            t[bytes((b, 0))] = -b
+
+        self.assertIsNone(t._root._labels)
+        self.assertEqual(len(t), 512)
+        for b in range(256):
+            self.assertEqual(t[bytes((b,))], b)
+            self.assertEqual(t[bytes((b, 0))], -b)
+        self.assertEqual(list(t), sorted(list(t)))
+
+        for b in range(256 - _WIDE_FANOUT // 2):
+            del t[bytes((b, 0))]
+            del t[bytes((b,))]
+        self.assertIsNotNone(t._root._labels)
+        self.assertEqual(len(t), _WIDE_FANOUT)
+
+    def test_random_operations_match_dict(self):
+        rng = Random(8)
+        t = BytesTrieMap()
+        model = {}
+        for i in range(5000):
+            key = bytes(rng.choice(b'\x00\x01ab\xff')
+                        for _ in range(rng.randint(1, 5)))
+            if key in model and rng.random() < 0.4:
+                del t[key]
+                del model[key]
+            else:
+                t[key] = i
+                model[key] = i
+
+        self.assertEqual(len(t), len(model))
+        self.assertEqual(list(t.items()), sorted(model.items()))
+        for prefix in (b'\x00', b'a\xff', b'zz'):
+            self.assertEqual(list(t.with_prefix(prefix)),
+                             sorted((k, v) for k, v in model.items()
+                                    if k.startswith(prefix)))
+
+        for key in list(model):
+            del t[key]
+        self.assertEqual(len(t), 0)
+        self.assertEqual(t._root.num_children(), 0)
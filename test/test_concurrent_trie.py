@@ -0,0 +1,103 @@
+import unittest
+from random import Random
+from threading import Thread, Event
+
+from concurrent_trie import ConcurrentTrieMap
+
+
+class TestConcurrentTrieMap(unittest.TestCase):
+    def test_matches_dict(self):
+        rng = Random(7)
+        t = ConcurrentTrieMap()
+        model = {}
+        for i in range(2000):
+            key = ''.join(rng.choice('abc') for _ in range(rng.randint(1, 5)))
+            if key in model and rng.random() < 0.4:
+                del t[key]
+                del model[key]
+            else:
+                t[key] = i
+                model[key] = i
+
+        self.assertEqual(len(t), len(model))
+        self.assertEqual(list(t.items()), sorted(model.items()))
+        for key, value in model.items():
+            self.assertEqual(t[key], value)
+            self.assertTrue(key in t)
+        self.assertEqual(list(t.with_prefix('ab')),
+                         sorted((k, v) for k, v in model.items()
+                                if k.startswith('ab')))
+
+        with self.assertRaises(KeyError):
+            t['']
+        with self.assertRaises(KeyError):
+            del t['abcabc']
+        self.assertIsNone(t.get('abcabc'))
+
+    def test_snapshot_is_isolated(self):
+        t = ConcurrentTrieMap()
+        t.update([('a', 1), ('ab', 2)])
+        snap = t.snapshot()
+
+        t['a'] = 10
+        t['b'] = 3
+        del t['ab']
+
+        self.assertEqual(list(snap.items()), [('a', 1), ('ab', 2)])
+        self.assertEqual(len(snap), 2)
+        self.assertEqual(list(t.items()), [('a', 10), ('b', 3)])
+
+    def test_batch_is_atomic(self):
+        t = ConcurrentTrieMap()
+        t['x'] = 0
+        before = t.snapshot()
+        with t.batch() as batch:
+            batch['x'] = 1
+            batch['y'] = 1
+            del batch['x']
+            batch['x'] = 2
+            self.assertEqual(batch['x'], 2)
+            self.assertEqual(t['x'], 0)
+            self.assertFalse('y' in t)
+
+        self.assertEqual(list(t.items()), [('x', 2), ('y', 1)])
+        self.assertEqual(list(before.items()), [('x', 0)])
+
+        with self.assertRaises(RuntimeError):
+            with t.batch() as batch:
+                batch['z'] = 1
+                raise RuntimeError()
+        self.assertFalse('z' in t)
+
+        # the writer lock was released both times
+        t['z'] = 3
+        self.assertEqual(t['z'], 3)
+
+    def test_readers_see_consistent_versions(self):
+        t = ConcurrentTrieMap()
+        keys = ['user/{}'.format(i) for i in range(20)]
+        t.update((key, 0) for key in keys)
+        done = Event()
+        errors = []
+
+        def reader():
+            while not done.is_set():
+                snap = t.snapshot()
+                values = set(value for _, value in snap.with_prefix('user/'))
+                if len(values) != 1 or len(snap) != len(keys):
+                    errors.append(values)
+
+        readers = [Thread(target=reader) for _ in range(4)]
+        for r in readers:
+            r.start()
+
+        for version in range(1, 200):
+            t.update((key, version) for key in keys)
+
+        done.set()
+        for r in readers:
+            r.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(set(t.snapshot().items()),
+                         set((key, 199) for key in keys))
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+
+from frozen_trie import FrozenTrieMap
+from trie import TrieMap
+
+
+class TestFrozenTrieMap(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'trie.bin')
+
+        rng = Random(2)
+        self._model = {}
+        self._trie = TrieMap()
+        for i in range(500):
+            key = ''.join(rng.choice('abcж')
+                          for _ in range(rng.randint(1, 6)))
+            value = (i, key) if i % 2 else i
+            self._trie[key] = value
+            self._model[key] = value
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _freeze(self, trie):
+        FrozenTrieMap.build(trie, self._path)
+        return FrozenTrieMap(self._path)
+
+    def test_lookup(self):
+        with self._freeze(self._trie) as frozen:
+            self.assertEqual(len(frozen), len(self._model))
+            for key, value in self._model.items():
+                self.assertTrue(key in frozen)
+                self.assertEqual(frozen[key], value)
+
+            for key in ('', 'x', 'aaaaaaa', 'жжжжжжж'):
+                if key in self._model:
+                    continue
+                self.assertFalse(key in frozen)
+                with self.assertRaises(KeyError):
+                    frozen[key]
+
+    def test_iteration_matches_trie(self):
+        with self._freeze(self._trie) as frozen:
+            self.assertEqual(list(frozen.items()), list(self._trie.items()))
+            self.assertEqual(list(frozen), list(self._trie))
+            for prefix in (None, 'a', 'ab', 'ж', 'cc', 'x'):
+                self.assertEqual(list(frozen.with_prefix(prefix)),
+                                 list(self._trie.with_prefix(prefix)))
+
+    def test_compact_trie(self):
+        trie = TrieMap(compact=True)
+        for key, value in self._model.items():
+            trie[key] = value
+
+        with self._freeze(trie) as frozen:
+            self.assertEqual(list(frozen.items()), list(trie.items()))
+
+    def test_empty_trie(self):
+        with self._freeze(TrieMap()) as frozen:
+            self.assertEqual(len(frozen), 0)
+            self.assertEqual(list(frozen.items()), [])
+            self.assertFalse('a' in frozen)
+
+    def test_shared_readers(self):
+        FrozenTrieMap.build(self._trie, self._path)
+        first = FrozenTrieMap(self._path)
+        second = FrozenTrieMap(self._path)
+        key = next(iter(self._model))
+        self.assertEqual(first[key], second[key])
+        first.close()
+        self.assertEqual(second[key], self._model[key])
+        second.close()
+        second.close()
+
+    def test_rejects_other_files(self):
+        with open(self._path, 'wb') as f:
+            f.write(b'not a trie' * 10)
+
+        with self.assertRaises(ValueError):
+            FrozenTrieMap(self._path)
@@ -0,0 +1,200 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+import process_pool
+from process_pool import ProcessPool, shared_memory
+from thread_pool import QueueFullError, ThreadPoolError
+
+process_pool_release = process_pool._release
+
+_worker_state = None
+
+
+def _init_worker(value):
+    global _worker_state
+    _worker_state = value
+
+
+def _worker_state_and_pid():
+    return _worker_state, os.getpid()
+
+
+def _square(x):
+    return x * x
+
+
+def _fail(msg):
+    raise ValueError(msg)
+
+
+def _describe(data):
+    return type(data).__name__, len(data), sum(data[::4096])
+
+
+class _SecondBlockFails(object):
+    # Stands in for the shared_memory module; creating a second block
+    # fails as if /dev/shm were full.
+
+    def __init__(self):
+        self._num_created = 0
+
+    def SharedMemory(self, create=False, size=0):
+        self._num_created += 1
+        if self._num_created == 2:
+            raise OSError("No space left on device")
+        return shared_memory.SharedMemory(create=create, size=size)
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self._pool = ProcessPool(num_processes=2)
+        self._pool.start()
+
+    def tearDown(self):
+        self._pool.stop()
+
+    def test_submit(self):
+        self.assertEqual(self._pool.submit(_square, 12).result(timeout=10),
+                         144)
+        with self.assertRaises(ValueError):
+            self._pool.submit(_fail, 'boom').result(timeout=10)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "needs Python 3.7")
+    def test_initializer_runs_in_workers(self):
+        pool = ProcessPool(num_processes=2, initializer=_init_worker,
+                           initargs=('ready',))
+        pool.start()
+        try:
+            state, pid = pool.submit(_worker_state_and_pid).result(10)
+            self.assertEqual(state, 'ready')
+            self.assertNotEqual(pid, os.getpid())
+        finally:
+            pool.stop()
+
+    @unittest.skipUnless(sys.version_info < (3, 7), "for Python 3.6")
+    def test_initializer_needs_python_3_7(self):
+        with self.assertRaises(ValueError):
+            ProcessPool(initializer=_init_worker, initargs=('ready',))
+
+    def test_map(self):
+        self.assertEqual(list(self._pool.map(_square, range(100),
+                                             chunksize=16)),
+                         [x * x for x in range(100)])
+
+    def test_stop_and_restart(self):
+        futures = [self._pool.submit(_square, x) for x in range(10)]
+        self._pool.stop()
+        self.assertEqual(self._pool.status, ProcessPool.STOPPED)
+        self.assertEqual([f.result(0) for f in futures],
+                         [x * x for x in range(10)])
+        with self.assertRaises(ThreadPoolError):
+            self._pool.submit(_square, 1)
+
+        self._pool.start()
+        self.assertEqual(self._pool.submit(_square, 3).result(10), 9)
+
+    def test_bounded_queue(self):
+        pool = ProcessPool(num_processes=1, queue_size=1,
+                           overload=ProcessPool.REJECT)
+        pool.start()
+        try:
+            futures = [pool.submit(time.sleep, 0.3) for _ in range(2)]
+            self.assertEqual(pool.queue_depth, 1)
+            with self.assertRaises(QueueFullError):
+                pool.submit(_square, 2)
+
+            for future in futures:
+                future.result(timeout=10)
+            self.assertEqual(pool.queue_depth, 0)
+            self.assertEqual(pool.submit(_square, 2).result(10), 4)
+        finally:
+            pool.stop()
+
+    def test_caller_runs(self):
+        pool = ProcessPool(num_processes=1, queue_size=1,
+                           overload=ProcessPool.CALLER_RUNS)
+        pool.start()
+        try:
+            futures = [pool.submit(time.sleep, 0.3) for _ in range(2)]
+            _, pid = pool.submit(_worker_state_and_pid).result(0)
+            self.assertEqual(pid, os.getpid())
+            for future in futures:
+                future.result(timeout=10)
+        finally:
+            pool.stop()
+
+    @unittest.skipIf(shared_memory is None, "needs Python 3.8")
+    def test_large_arguments_use_shared_memory(self):
+        data = bytes(range(256)) * 8192   # 2 MiB
+        args, blocks = self._pool._share((data, 5))
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(args[1], 5)
+        self.assertEqual(args[0].load(), data)
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+        for arg in (data, bytearray(data), memoryview(data)):
+            future = self._pool.submit(_describe, arg)
+            self.assertEqual(future.result(timeout=10),
+                             (type(arg).__name__, len(data),
+                              sum(data[::4096])))
+
+        self.assertEqual(self._pool._share((b'small',))[1], [])
+
+    def _record_releases(self):
+        # Returns the names of the blocks released from now on, and an
+        # event set on every release.
+        released = []
+        done = threading.Event()
+
+        def release(blocks):
+            released.extend(block.name for block in blocks)
+            process_pool_release(blocks)
+            done.set()
+
+        process_pool._release = release
+        self.addCleanup(setattr, process_pool, '_release',
+                        process_pool_release)
+        return released, done
+
+    def _assert_unlinked(self, names):
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    @unittest.skipIf(shared_memory is None, "needs Python 3.8")
+    def test_shared_memory_is_released(self):
+        released, done = self._record_releases()
+        self._pool.submit(_describe, b'x' * (2 << 20)).result(10)
+        self.assertTrue(done.wait(10))
+        self.assertEqual(len(released), 1)
+        self._assert_unlinked(released)
+
+    @unittest.skipIf(shared_memory is None, "needs Python 3.8")
+    def test_shared_memory_is_released_on_errors(self):
+        released, _ = self._record_releases()
+        data = b'x' * (2 << 20)
+
+        def broken_submit(*args):
+            raise RuntimeError("broken pool")
+
+        self._pool._executor.submit = broken_submit
+        with self.assertRaises(RuntimeError):
+            self._pool.submit(_describe, data)
+        del self._pool._executor.submit
+        self.assertEqual(len(released), 1)
+        self.assertEqual(self._pool.queue_depth, 0)
+
+        process_pool.shared_memory = _SecondBlockFails()
+        try:
+            with self.assertRaises(OSError):
+                self._pool.submit(_describe, data, data)
+        finally:
+            process_pool.shared_memory = shared_memory
+        self.assertEqual(len(released), 2)
+        self._assert_unlinked(released)
+        self.assertEqual(self._pool.submit(_square, 4).result(10), 16)
@@ -0,0 +1,115 @@
+import unittest
+from random import Random
+
+from radix_trie import RadixTrieMap
+
+
+def _check_structure(test, trie):
+    # Every non-root node has a non-empty label, and no non-terminal node
+    # other than the root is a pass-through with a single child.
+    stack = [trie._root]
+    num_nodes = 0
+    while stack:
+        node = stack.pop()
+        num_nodes += 1
+        for first, child in node._children.items():
+            test.assertTrue(child._label)
+            test.assertEqual(child._label[0], first)
+            if not child._terminal:
+                test.assertGreater(len(child._children), 1)
+            stack.append(child)
+
+    return num_nodes
+
+
+class TestRadixTrieMap(unittest.TestCase):
+    def test_empty(self):
+        t = RadixTrieMap()
+        self.assertEqual(len(t), 0)
+        self.assertEqual(list(t), [])
+        self.assertEqual(list(t.with_prefix('a')), [])
+        self.assertFalse('a' in t)
+        with self.assertRaises(KeyError):
+            t['a']
+        with self.assertRaises(KeyError):
+            t[''] = 1
+
+    def test_edge_split_and_lookup(self):
+        t = RadixTrieMap()
+        t['/usr/local/bin'] = 1
+        t['/usr/local/lib'] = 2
+        t['/usr'] = 3
+
+        self.assertEqual(t['/usr/local/bin'], 1)
+        self.assertEqual(t['/usr/local/lib'], 2)
+        self.assertEqual(t['/usr'], 3)
+        for key in ('/us', '/usr/', '/usr/local/', '/usr/local/binx'):
+            self.assertFalse(key in t)
+            with self.assertRaises(KeyError):
+                t[key]
+
+        # root -> '/usr' -> '/local/' -> {'bin', 'lib'}
+        self.assertEqual(_check_structure(self, t), 5)
+        self.assertEqual(list(t), ['/usr', '/usr/local/bin', '/usr/local/lib'])
+
+    def test_delete_merges_edges(self):
+        t = RadixTrieMap()
+        for key in ('abcdef', 'abcxyz', 'abc'):
+            t[key] = key
+
+        del t['abc']
+        self.assertEqual(_check_structure(self, t), 4)
+        del t['abcxyz']
+        self.assertEqual(_check_structure(self, t), 2)
+        self.assertEqual(t._root._children['a']._label, 'abcdef')
+        self.assertEqual(list(t.items()), [('abcdef', 'abcdef')])
+
+        with self.assertRaises(KeyError):
+            del t['abc']
+        with self.assertRaises(KeyError):
+            del t['abcdefg']
+
+        del t['abcdef']
+        self.assertEqual(len(t), 0)
+        self.assertEqual(_check_structure(self, t), 1)
+
+    def test_with_prefix_inside_edge(self):
+        t = RadixTrieMap()
+        for key in ('http://a.com/x', 'http://a.com/y', 'http://b.org'):
+            t[key] = len(key)
+
+        self.assertEqual(list(t.with_prefix('http://a')),
+                         [('http://a.com/x', 14), ('http://a.com/y', 14)])
+        self.assertEqual(list(t.with_prefix('http://')), list(t.items()))
+        self.assertEqual(list(t.with_prefix('http://a.com/x')),
+                         [('http://a.com/x', 14)])
+        self.assertEqual(list(t.with_prefix('http://c')), [])
+        self.assertEqual(list(t.with_prefix('http://a.com/xy')), [])
+
+    def test_random_operations_match_dict(self):
+        rng = Random(1)
+        t = RadixTrieMap()
+        model = {}
+        for i in range(3000):
+            key = ''.join(rng.choice('ab/') for _ in range(rng.randint(1, 8)))
+            if rng.random() < 0.35 and model:
+                key = rng.choice(sorted(model))
+                del t[key]
+                del model[key]
+            else:
+                t[key] = i
+                model[key] = i
+
+            if i % 250 == 0:
+                _check_structure(self, t)
+
+        _check_structure(self, t)
+        self.assertEqual(len(t), len(model))
+        self.assertEqual(list(t.items()), sorted(model.items()))
+        for key, value in model.items():
+            self.assertEqual(t[key], value)
+
+        for prefix in ('a', 'ab', 'b/', '/a/'):
+            expected = sorted((k, v) for k, v in model.items()
+                              if k.startswith(prefix))
+            self.assertEqual(list(t.with_prefix(prefix)), expected)
@@ -0,0 +1,639 @@
+import asyncio
+import threading
+import time
+import unittest
+from collections import deque
+from concurrent.futures import CancelledError, TimeoutError
+from functools import partial
+
+from thread_pool import (ThreadPool, ThreadPoolError, JobExpiredError,
+                         QueueFullError, as_completed)
+
+
+def _square(x):
+    return x * x
+
+
+def _fail(msg):
+    raise ValueError(msg)
+
+
+def _run_coroutine(coroutine):
+    # asyncio.run needs Python 3.7.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestThreadPool(unittest.TestCase):
+    work_stealing = False
+
+    def _new_pool(self, num_threads=4, **kwargs):
+        return ThreadPool(num_threads=num_threads,
+                          work_stealing=self.work_stealing, **kwargs)
+
+    def _wait_for_size(self, pool, size):
+        deadline = time.monotonic() + 5
+        while pool.size != size and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return pool.size
+
+    def setUp(self):
+        self._pool = self._new_pool()
+        self._pool.start()
+
+    def tearDown(self):
+        self._pool.stop()
+
+    def test_submit_returns_future(self):
+        future = self._pool.submit(_square, 7)
+        self.assertEqual(future.result(timeout=5), 49)
+        self.assertTrue(future.done())
+        self.assertIsNone(future.exception())
+
+    def test_exception_is_set_on_future(self):
+        future = self._pool.submit(_fail, 'boom')
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+        self.assertIsInstance(future.exception(), ValueError)
+
+    def test_failing_jobs_keep_workers_alive(self):
+        failures = [self._pool.submit(_fail, str(i)) for i in range(20)]
+        for future in failures:
+            self.assertIsInstance(future.exception(timeout=5), ValueError)
+
+        self.assertTrue(all(t.is_alive()
+                            for t in self._pool._threads.values()))
+
+        # Every worker has to be there for four jobs that wait for each
+        # other to finish.
+        barrier = threading.Barrier(4, timeout=5)
+        futures = [self._pool.submit(barrier.wait) for _ in range(4)]
+        self.assertEqual(sorted(f.result(timeout=5) for f in futures),
+                         [0, 1, 2, 3])
+
+    def test_done_callback(self):
+        done = threading.Event()
+        results = []
+
+        def callback(future):
+            results.append(future.result())
+            done.set()
+
+        self._pool.submit(_square, 3).add_done_callback(callback)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, [9])
+
+    def test_map(self):
+        self.assertEqual(list(self._pool.map(_square, range(50))),
+                         [x * x for x in range(50)])
+        self.assertEqual(list(self._pool.map(pow, [2, 3], [5, 2])), [32, 9])
+
+        with self.assertRaises(ValueError):
+            list(self._pool.map(_fail, ['a']))
+
+    def test_map_chunksize(self):
+        for chunksize in (1, 7, 1000):
+            self.assertEqual(list(self._pool.map(_square, range(250),
+                                                 chunksize=chunksize)),
+                             [x * x for x in range(250)])
+
+        unordered = self._pool.map(_square, range(250), chunksize=7,
+                                   ordered=False)
+        self.assertEqual(sorted(unordered), [x * x for x in range(250)])
+
+        with self.assertRaises(ValueError):
+            list(self._pool.map(_fail, ['a', 'b', 'c'], chunksize=2))
+        with self.assertRaises(ValueError):
+            self._pool.map(_square, range(3), chunksize=0)
+
+    def test_submit_batch(self):
+        # More jobs than the queue holds; the batch waits for room.
+        futures = self._pool.submit_batch([partial(_square, x)
+                                           for x in range(250)])
+        self.assertEqual([f.result(timeout=5) for f in futures],
+                         [x * x for x in range(250)])
+        self.assertEqual(self._pool.submit_batch([]), [])
+
+        self._pool.stop()
+        with self.assertRaises(ThreadPoolError):
+            self._pool.submit_batch([partial(_square, 1)])
+
+    def test_map_timeout(self):
+        with self.assertRaises(TimeoutError):
+            list(self._pool.map(time.sleep, [1], timeout=0.01))
+
+    def test_as_completed(self):
+        futures = [self._pool.submit(time.sleep, d) for d in (0.2, 0)]
+        done = list(as_completed(futures, timeout=5))
+        self.assertEqual(done, futures[::-1])
+
+    def test_cancel_queued_job(self):
+        release = threading.Event()
+        blockers = [self._pool.submit(release.wait) for _ in range(4)]
+        queued = self._pool.submit(_square, 2)
+        self.assertTrue(queued.cancel())
+        release.set()
+
+        for future in blockers:
+            self.assertTrue(future.result(timeout=5))
+        with self.assertRaises(CancelledError):
+            queued.result()
+
+    def test_stop_runs_queued_jobs(self):
+        futures = [self._pool.submit(time.sleep, 0.01) for _ in range(20)]
+        self._pool.stop()
+        self.assertEqual(self._pool.status, ThreadPool.STOPPED)
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertFalse(any(t.is_alive()
+                             for t in self._pool._threads.values()))
+
+        with self.assertRaises(ThreadPoolError):
+            self._pool.submit(_square, 1)
+
+    def test_restart(self):
+        self._pool.stop()
+        self._pool.start()
+        self.assertEqual(self._pool.submit(_square, 5).result(timeout=5), 25)
+
+    def test_submit_before_start(self):
+        pool = self._new_pool()
+        with self.assertRaises(ThreadPoolError):
+            pool.submit(_square, 1)
+
+    def test_fixed_size(self):
+        self.assertEqual(self._pool.size, 4)
+        self.assertEqual((self._pool.min_threads, self._pool.max_threads),
+                         (4, 4))
+        with self.assertRaises(ValueError):
+            self._new_pool(min_threads=3, max_threads=2)
+
+    def test_elastic_grows_and_retires(self):
+        pool = self._new_pool(min_threads=1, max_threads=4, idle_timeout=0.1)
+        pool.start()
+        try:
+            self.assertEqual(pool.size, 1)
+            release = threading.Event()
+            futures = [pool.submit(release.wait, 5) for _ in range(6)]
+            self.assertEqual(pool.size, 4)
+
+            release.set()
+            self.assertTrue(all(f.result(timeout=5) for f in futures))
+            self.assertEqual(self._wait_for_size(pool, 1), 1)
+            self.assertEqual(pool.submit(_square, 3).result(timeout=5), 9)
+        finally:
+            pool.stop()
+
+    def test_elastic_from_zero(self):
+        pool = self._new_pool(min_threads=0, max_threads=2, idle_timeout=0.05)
+        pool.start()
+        try:
+            self.assertEqual(pool.size, 0)
+            for i in range(3):
+                self.assertEqual(pool.submit(_square, i).result(timeout=5),
+                                 i * i)
+                self.assertEqual(self._wait_for_size(pool, 0), 0)
+        finally:
+            pool.stop()
+
+    def test_scale_up_on_wait_time(self):
+        pool = self._new_pool(min_threads=1, max_threads=2,
+                              scale_up_depth=100, scale_up_wait=0.05)
+        pool.start()
+        try:
+            release = threading.Event()
+            futures = [pool.submit(release.wait, 5) for _ in range(2)]
+            self.assertEqual(pool.size, 1)
+
+            time.sleep(0.1)
+            futures.append(pool.submit(_square, 2))
+            self.assertEqual(pool.size, 2)
+            release.set()
+            self.assertEqual(futures[-1].result(timeout=5), 4)
+        finally:
+            pool.stop()
+
+    def test_scale_up_on_wait_time_without_submits(self):
+        # Nothing is submitted or picked up once the jobs are queued, so
+        # only the monitor can notice how long they have waited.
+        pool = self._new_pool(min_threads=1, max_threads=4,
+                              scale_up_depth=100, scale_up_wait=0.05)
+        pool.start()
+        try:
+            release = threading.Event()
+            started = threading.Event()
+
+            def blocker():
+                started.set()
+                release.wait(5)
+
+            blocked = pool.submit(blocker)
+            started.wait(5)
+            futures = [pool.submit(_square, i) for i in range(5)]
+            self.assertEqual([f.result(timeout=1) for f in futures],
+                             [i * i for i in range(5)])
+            self.assertFalse(blocked.done())
+            self.assertGreater(pool.size, 1)
+            release.set()
+        finally:
+            pool.stop()
+
+    def _run_blocked(self, submit_jobs, **kwargs):
+        # Holds the only worker of a new pool while submit_jobs queues more
+        # work, then lets it go; returns the order the jobs ran in.
+        pool = self._new_pool(num_threads=1, **kwargs)
+        pool.start()
+        try:
+            release = threading.Event()
+            started = threading.Event()
+
+            def blocker():
+                started.set()
+                release.wait(5)
+
+            pool.submit(blocker)
+            started.wait(5)
+            order = []
+            futures = submit_jobs(pool, order.append)
+            release.set()
+            for future in futures:
+                future.exception(timeout=5)
+            return order, futures
+        finally:
+            pool.stop()
+
+    def test_priority_order(self):
+        def submit_jobs(pool, record):
+            return [pool.submit(record, name, priority=priority)
+                    for name, priority in (('a', 5), ('b', 0), ('c', 3),
+                                           ('d', 0))]
+
+        order, _ = self._run_blocked(submit_jobs)
+        self.assertEqual(order, ['b', 'd', 'c', 'a'])
+
+    def test_aging(self):
+        def submit_jobs(pool, record):
+            futures = [pool.submit(record, 'background', priority=10)]
+            time.sleep(0.2)
+            futures.append(pool.submit(record, 'urgent'))
+            return futures
+
+        order, _ = self._run_blocked(submit_jobs, aging=0.01)
+        self.assertEqual(order, ['background', 'urgent'])
+        order, _ = self._run_blocked(submit_jobs, aging=None)
+        self.assertEqual(order, ['urgent', 'background'])
+
+    def test_scale_up_wait_measures_the_oldest_job(self):
+        def submit_jobs(pool, record):
+            priority = 0 if pool.work_stealing else 10
+            before = time.monotonic()
+            futures = [pool.submit(record, 'old', priority=priority)]
+            time.sleep(0.05)
+            after = time.monotonic()
+            futures.append(pool.submit(record, 'new'))
+            with pool._lock:
+                oldest = pool._oldest_enqueue_time()
+            self.assertTrue(before <= oldest <= after)
+            return futures
+
+        order, _ = self._run_blocked(submit_jobs, max_threads=2, aging=None,
+                                     scale_up_depth=100, scale_up_wait=10)
+        self.assertEqual(sorted(order), ['new', 'old'])
+
+    def test_deadline(self):
+        def submit_jobs(pool, record):
+            futures = [pool.submit(record, 'late',
+                                   deadline=time.monotonic() + 0.05),
+                       pool.submit(record, 'on time',
+                                   deadline=time.monotonic() + 10)]
+            time.sleep(0.1)
+            return futures
+
+        order, futures = self._run_blocked(submit_jobs)
+        self.assertEqual(order, ['on time'])
+        self.assertIsInstance(futures[0].exception(), JobExpiredError)
+        self.assertIsNone(futures[1].exception())
+
+    def test_reject_when_full(self):
+        def submit_jobs(pool, record):
+            futures = [pool.submit(record, name) for name in 'ab']
+            self.assertEqual(pool.queue_depth, 2)
+            with self.assertRaises(QueueFullError):
+                pool.submit(record, 'c')
+            batch = pool.submit_batch([partial(record, 'd')])
+            self.assertIsInstance(batch[0].exception(), QueueFullError)
+            return futures
+
+        order, _ = self._run_blocked(submit_jobs, queue_size=2,
+                                     overload=ThreadPool.REJECT)
+        self.assertEqual(order, ['a', 'b'])
+
+    def test_block_with_timeout(self):
+        def submit_jobs(pool, record):
+            futures = [pool.submit(record, name) for name in 'ab']
+            start = time.monotonic()
+            with self.assertRaises(QueueFullError):
+                pool.submit(record, 'c')
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+            return futures
+
+        order, _ = self._run_blocked(submit_jobs, queue_size=2,
+                                     block_timeout=0.05)
+        self.assertEqual(order, ['a', 'b'])
+
+    def test_drop_oldest(self):
+        def submit_jobs(pool, record):
+            futures = [pool.submit(record, name) for name in 'abc']
+            self.assertTrue(futures[0].cancelled())
+            self.assertEqual(pool.queue_depth, 2)
+            return futures[1:]
+
+        order, _ = self._run_blocked(submit_jobs, queue_size=2,
+                                     overload=ThreadPool.DROP_OLDEST)
+        self.assertEqual(order, ['b', 'c'])
+
+    def test_caller_runs(self):
+        def submit_jobs(pool, record):
+            futures = [pool.submit(record, name) for name in 'ab']
+            caller_run = pool.submit(threading.current_thread)
+            self.assertIs(caller_run.result(0), threading.current_thread())
+            futures.append(pool.submit(record, 'c'))
+            return futures
+
+        order, _ = self._run_blocked(submit_jobs, queue_size=1,
+                                     overload=ThreadPool.CALLER_RUNS)
+        self.assertEqual(order, ['b', 'c', 'a'])
+
+    def test_overload_arguments(self):
+        with self.assertRaises(ValueError):
+            self._new_pool(overload='shed')
+        with self.assertRaises(ValueError):
+            self._new_pool(queue_size=0)
+
+        pool = self._new_pool(num_threads=1, queue_size=None)
+        pool.start()
+        try:
+            futures = pool.submit_batch([partial(time.sleep, 0)] * 500)
+            self.assertTrue(all(f.result(5) is None for f in futures))
+        finally:
+            pool.stop()
+
+    def test_stats_without_metrics(self):
+        stats = self._pool.stats()
+        self.assertEqual(stats['threads'], 4)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertNotIn('submitted', stats)
+
+    def test_metrics(self):
+        pool = self._new_pool(metrics=True)
+        pool.start()
+        try:
+            futures = [pool.submit(time.sleep, 0.01) for _ in range(5)]
+            futures += [pool.submit(_fail, 'x') for _ in range(2)]
+            for future in futures:
+                future.exception(timeout=5)
+
+            stats = pool.stats()
+        finally:
+            pool.stop()
+
+        self.assertEqual((stats['submitted'], stats['completed'],
+                          stats['failed']), (7, 5, 2))
+        self.assertEqual(stats['queue_wait']['count'], 7)
+        run_time = stats['run_time']
+        self.assertEqual(run_time['count'], 7)
+        self.assertGreaterEqual(run_time['max'], 0.01)
+        self.assertLessEqual(run_time['p50'], run_time['max'])
+        self.assertEqual(sum(num for _, num in run_time['buckets']), 7)
+
+    def test_metrics_under_overload(self):
+        pools = []
+
+        def submit_jobs(pool, record):
+            pools.append(pool)
+            futures = [pool.submit(record, 'a'),
+                       pool.submit(record, 'late',
+                                   deadline=time.monotonic() + 0.05)]
+            with self.assertRaises(QueueFullError):
+                pool.submit(record, 'rejected')
+            time.sleep(0.1)
+            return futures
+
+        order, _ = self._run_blocked(submit_jobs, queue_size=2,
+                                     overload=ThreadPool.REJECT,
+                                     metrics=True)
+        self.assertEqual(order, ['a'])
+
+        # The blocker, 'a' and 'late' were queued.
+        stats = pools[0].stats()
+        self.assertEqual((stats['submitted'], stats['rejected'],
+                          stats['expired'], stats['completed']),
+                         (3, 1, 1, 2))
+        self.assertEqual(stats['max_queue_depth'], 2)
+
+    def test_hooks(self):
+        events = []
+
+        def before_job(job):
+            events.append(('before', job))
+
+        def after_job(job, error):
+            events.append(('after', job, type(error)))
+            raise RuntimeError("hook failures are only logged")
+
+        pool = self._new_pool(num_threads=1, before_job=before_job,
+                              after_job=after_job)
+        pool.start()
+        with self.assertLogs('THREADPOOL', level='ERROR') as logs:
+            try:
+                self.assertEqual(pool.submit(_square, 3).result(timeout=5),
+                                 9)
+                with self.assertRaises(ValueError):
+                    pool.submit(_fail, 'x').result(timeout=5)
+            finally:
+                # Joins the worker, so both hook failures have been logged.
+                pool.stop()
+
+        self.assertEqual([record.getMessage() for record in logs.records],
+                         ["after_job hook failed"] * 2)
+        self.assertTrue(all(record.exc_info[0] is RuntimeError
+                            for record in logs.records))
+        self.assertEqual(events, [('before', _square),
+                                  ('after', _square, type(None)),
+                                  ('before', _fail),
+                                  ('after', _fail, ValueError)])
+
+    def test_jobs_submitted_by_jobs(self):
+        def parent(depth):
+            if depth == 0:
+                return 1
+            children = [self._pool.submit(parent, depth - 1)
+                        for _ in range(2)]
+            return children
+
+        def total(result):
+            if isinstance(result, list):
+                return sum(total(f.result(timeout=5)) for f in result)
+            return result
+
+        self.assertEqual(total(self._pool.submit(parent, 5).result(5)), 32)
+
+    def test_submit_async(self):
+        async def main():
+            async with self._new_pool(num_threads=2) as pool:
+                future = await pool.submit_async(_square, 7)
+                self.assertIsInstance(future, asyncio.Future)
+                self.assertEqual(await future, 49)
+                with self.assertRaises(ValueError):
+                    await (await pool.submit_async(_fail, 'boom'))
+            return pool
+
+        self.assertEqual(_run_coroutine(main()).status, ThreadPool.STOPPED)
+
+    def _run_async_blocked(self, main, **kwargs):
+        # _run_blocked for coroutines: runs main(pool, release, record) on
+        # an event loop while the only worker is held, and returns the
+        # order the jobs ran in.
+        pool = self._new_pool(num_threads=1, **kwargs)
+        pool.start()
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+
+        try:
+            pool.submit(blocker)
+            started.wait(5)
+            order = []
+            _run_coroutine(main(pool, release, order.append))
+            return order
+        finally:
+            release.set()
+            pool.stop()
+
+    def test_submit_async_suspends_when_full(self):
+        async def main(pool, release, record):
+            futures = [await pool.submit_async(record, 'a')]
+            task = asyncio.ensure_future(pool.submit_async(record, 'b'))
+            # The loop keeps running while the submit waits for room.
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            release.set()
+            futures.append(await task)
+            await asyncio.gather(*futures)
+
+        order = self._run_async_blocked(main, queue_size=1)
+        self.assertEqual(order, ['a', 'b'])
+
+    def test_submit_async_overload(self):
+        async def main(pool, release, record):
+            futures = [await pool.submit_async(record, 'a')]
+            start = time.monotonic()
+            with self.assertRaises(QueueFullError):
+                await pool.submit_async(record, 'b')
+            if pool.overload == ThreadPool.BLOCK:
+                self.assertGreaterEqual(time.monotonic() - start, 0.05)
+                self.assertEqual(pool.stats()['rejected'], 1)
+            release.set()
+            await asyncio.gather(*futures)
+
+        order = self._run_async_blocked(main, queue_size=1,
+                                        block_timeout=0.05, metrics=True)
+        self.assertEqual(order, ['a'])
+        order = self._run_async_blocked(main, queue_size=1,
+                                        overload=ThreadPool.REJECT)
+        self.assertEqual(order, ['a'])
+
+    def test_cancel_async_future(self):
+        async def main(pool, release, record):
+            cancelled = await pool.submit_async(record, 'a')
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            # Still holding its slot until a worker discards it.
+            task = asyncio.ensure_future(pool.submit_async(record, 'b'))
+            await asyncio.sleep(0.01)
+            release.set()
+            await (await task)
+
+        order = self._run_async_blocked(main, queue_size=1)
+        self.assertEqual(order, ['b'])
+
+    def test_cancel_woken_async_submit(self):
+        async def main(pool, release, record):
+            taken = threading.Event()
+
+            def first():
+                record('a')
+                taken.set()
+
+            await pool.submit_async(first)
+            woken = asyncio.ensure_future(pool.submit_async(record, 'b'))
+            waiting = asyncio.ensure_future(pool.submit_async(record, 'c'))
+            await asyncio.sleep(0.01)
+            release.set()
+            # Blocks the loop, so the woken submit is cancelled before it
+            # can retry; its wake must go to the other one.
+            taken.wait(5)
+            woken.cancel()
+            await (await asyncio.wait_for(waiting, 5))
+            self.assertTrue(woken.cancelled())
+
+        order = self._run_async_blocked(main, queue_size=1)
+        self.assertEqual(order, ['a', 'c'])
+
+
+class TestWorkStealingThreadPool(TestThreadPool):
+    work_stealing = True
+
+    def test_priority_order(self):
+        with self.assertRaises(ValueError):
+            self._pool.submit(_square, 2, priority=1)
+        self.assertEqual(self._pool.submit(_square, 2, priority=0).result(5),
+                         4)
+
+    def test_aging(self):
+        self.skipTest("work-stealing pools have no priorities")
+
+    def test_jobs_from_a_worker_stay_local(self):
+        pool = self._new_pool(num_threads=1)
+        pool.start()
+        try:
+            def parent():
+                child = pool.submit(_square, 4)
+                return (len(pool._deques[0]), len(pool._queue), child)
+
+            local, shared, child = pool.submit(parent).result(timeout=5)
+            self.assertEqual((local, shared), (1, 0))
+            self.assertEqual(child.result(timeout=5), 16)
+        finally:
+            pool.stop()
+
+    def test_idle_workers_steal(self):
+        # The parent blocks its worker until all of its children are done,
+        # so they can only run if the other workers steal them.
+        done = threading.Event()
+        finished = []
+
+        def child():
+            finished.append(threading.current_thread().name)
+            if len(finished) == 10:
+                done.set()
+
+        def parent():
+            for _ in range(10):
+                self._pool.submit(child)
+            return done.wait(5)
+
+        self.assertTrue(self._pool.submit(parent).result(timeout=10))
+        self.assertEqual(len(finished), 10)
+
+    def test_victims_are_found_by_identity(self):
+        pool = self._new_pool()
+        pool._deques = [deque() for _ in range(3)]
+        others = pool._others(pool._deques[2])
+        self.assertEqual([id(d) for d in others],
+                         [id(d) for d in pool._deques[:2]])
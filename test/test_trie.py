@@ -0,0 +1,601 @@
+import gc
+import tracemalloc
+import unittest
+from itertools import islice
+from random import Random
+
+from trie import TrieMap, _NO_CHILDREN
+
+
+def _random_keys(num_keys, seed=0, alphabet='abcd', max_len=6):
+    rng = Random(seed)
+    keys = set()
+    while len(keys) < num_keys:
+        length = rng.randint(1, max_len)
+        keys.add(''.join(rng.choice(alphabet) for _ in range(length)))
+
+    return list(keys)
+
+
+def _levenshtein(a, b):
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        prev, row = row, [i]
+        for j, cb in enumerate(b, 1):
+            row.append(min(prev[j] + 1, row[j - 1] + 1,
+                           prev[j - 1] + (ca != cb)))
+
+    return row[-1]
+
+
+class TestTrieMap(unittest.TestCase):
+    compact = False
+
+    def _new_trie(self):
+        return TrieMap(compact=self.compact)
+
+    def setUp(self):
+        self._keys = _random_keys(300)
+        self._trie = self._new_trie()
+        for i, key in enumerate(self._keys):
+            self._trie[key] = i
+
+    def test_empty(self):
+        t = self._new_trie()
+        self.assertEqual(len(t), 0)
+        self.assertEqual(list(t), [])
+        self.assertEqual(list(t.items()), [])
+        self.assertEqual(list(t.with_prefix('a')), [])
+
+    def test_set_and_get(self):
+        self.assertEqual(len(self._trie), len(self._keys))
+        for i, key in enumerate(self._keys):
+            self.assertEqual(self._trie[key], i)
+
+        self._trie[self._keys[0]] = 'updated'
+        self.assertEqual(self._trie[self._keys[0]], 'updated')
+        self.assertEqual(len(self._trie), len(self._keys))
+
+    def test_missing_keys(self):
+        t = self._new_trie()
+        t['abc'] = 1
+        for key in ('', 'a', 'ab', 'abcd', 'x'):
+            with self.assertRaises(KeyError):
+                t[key]
+
+        with self.assertRaises(KeyError):
+            t[''] = 1
+
+    def test_iteration_is_sorted(self):
+        self.assertEqual(list(self._trie), sorted(self._keys))
+
+        expected = sorted((key, i) for i, key in enumerate(self._keys))
+        self.assertEqual(list(self._trie.items()), expected)
+
+    def test_iteration_with_unicode_keys(self):
+        t = self._new_trie()
+        keys = ['жук', 'ж', 'z', 'zzé', 'a\U0001f600']
+        for key in keys:
+            t[key] = key
+
+        self.assertEqual(list(t), sorted(keys))
+
+    def test_with_prefix(self):
+        pairs = dict((key, i) for i, key in enumerate(self._keys))
+        for prefix in ('a', 'ab', 'bca', 'dddd', self._keys[0]):
+            expected = sorted((key, value) for key, value in pairs.items()
+                              if key.startswith(prefix))
+            self.assertEqual(list(self._trie.with_prefix(prefix)), expected)
+
+        self.assertEqual(list(self._trie.with_prefix()),
+                         list(self._trie.items()))
+        self.assertEqual(list(self._trie.with_prefix('x')), [])
+
+    def test_with_prefix_stays_in_subtree(self):
+        t = self._new_trie()
+        for key in ('a', 'ab', 'abc', 'b', 'ba'):
+            t[key] = key
+
+        self.assertEqual(list(t.with_prefix('ab')),
+                         [('ab', 'ab'), ('abc', 'abc')])
+
+    def test_from_sorted(self):
+        pairs = sorted((key, i) for i, key in enumerate(self._keys))
+        t = TrieMap.from_sorted((pair for pair in pairs),
+                                compact=self.compact)
+        self.assertEqual(t.compact, self.compact)
+        self.assertEqual(len(t), len(pairs))
+        self.assertEqual(list(t.items()), pairs)
+        for key, value in pairs:
+            self.assertEqual(t[key], value)
+
+        t['zzz'] = 1
+        self.assertEqual(t['zzz'], 1)
+
+    def test_from_sorted_pause_gc(self):
+        def pairs(states):
+            for key in ('a', 'b'):
+                states.append(gc.isenabled())
+                yield key, 1
+
+        states = []
+        TrieMap.from_sorted(pairs(states), compact=self.compact)
+        self.assertEqual(states, [True, True])
+        states = []
+        TrieMap.from_sorted(pairs(states), compact=self.compact,
+                            pause_gc=True)
+        self.assertEqual(states, [False, False])
+        self.assertTrue(gc.isenabled())
+
+    def test_from_sorted_duplicates_and_errors(self):
+        t = TrieMap.from_sorted([('a', 1), ('ab', 2), ('ab', 3), ('b', 4)],
+                                compact=self.compact)
+        self.assertEqual(list(t.items()), [('a', 1), ('ab', 3), ('b', 4)])
+        self.assertEqual(len(t), 3)
+
+        with self.assertRaises(ValueError):
+            TrieMap.from_sorted([('b', 1), ('a', 2)], pause_gc=True)
+        self.assertTrue(gc.isenabled())
+        with self.assertRaises(KeyError):
+            TrieMap.from_sorted([('', 1)])
+
+        self.assertEqual(len(TrieMap.from_sorted([])), 0)
+
+    def test_prefixes_of(self):
+        t = self._new_trie()
+        for key in ('/', '/api', '/api/v1', '/api/v1/users', '/static'):
+            t[key] = len(key)
+
+        self.assertEqual(list(t.prefixes_of('/api/v1/users/42')),
+                         [('/', 1), ('/api', 4), ('/api/v1', 7),
+                          ('/api/v1/users', 13)])
+        self.assertEqual(list(t.prefixes_of('/api/v2')),
+                         [('/', 1), ('/api', 4)])
+        self.assertEqual(list(t.prefixes_of('/api')), [('/', 1), ('/api', 4)])
+        self.assertEqual(list(t.prefixes_of('x/api')), [])
+        self.assertEqual(list(t.prefixes_of('')), [])
+
+    def test_longest_prefix(self):
+        t = self._new_trie()
+        for key in ('10.', '10.1.', '10.1.2.'):
+            t[key] = key
+
+        self.assertEqual(t.longest_prefix('10.1.2.3'), ('10.1.2.', '10.1.2.'))
+        self.assertEqual(t.longest_prefix('10.1.3.4'), ('10.1.', '10.1.'))
+        self.assertEqual(t.longest_prefix('10.1.'), ('10.1.', '10.1.'))
+        self.assertEqual(t.longest_prefix('10.2'), ('10.', '10.'))
+        with self.assertRaises(KeyError):
+            t.longest_prefix('11.0')
+        with self.assertRaises(KeyError):
+            t.longest_prefix('')
+        self.assertIsNone(t.longest_prefix('1', None))
+
+        for s in ('abcdabcd', 'dcba', 'bbbbbbbbb'):
+            expected = [(key, i) for i, key in enumerate(self._keys)
+                        if s.startswith(key)]
+            expected.sort(key=lambda pair: len(pair[0]))
+            self.assertEqual(list(self._trie.prefixes_of(s)), expected)
+            if expected:
+                self.assertEqual(self._trie.longest_prefix(s), expected[-1])
+
+    def test_fuzzy_matches_brute_force(self):
+        pairs = dict((key, i) for i, key in enumerate(self._keys))
+        for query in ('abc', 'dddd', 'a', 'bacdab', 'xyz', ''):
+            for max_distance in (0, 1, 2):
+                expected = []
+                for key, value in sorted(pairs.items()):
+                    distance = _levenshtein(query, key)
+                    if distance <= max_distance:
+                        expected.append((key, value, distance))
+
+                self.assertEqual(list(self._trie.fuzzy(query, max_distance)),
+                                 expected)
+
+    def test_fuzzy_prunes_subtrees(self):
+        t = self._new_trie()
+        t['kitten'] = 1
+        t['sitting'] = 2
+        t['mitten'] = 3
+        self.assertEqual(list(t.fuzzy('kitten', 0)), [('kitten', 1, 0)])
+        self.assertEqual(list(t.fuzzy('kitten', 1)),
+                         [('kitten', 1, 0), ('mitten', 3, 1)])
+        self.assertEqual(list(t.fuzzy('kitten', 3)),
+                         [('kitten', 1, 0), ('mitten', 3, 1),
+                          ('sitting', 2, 3)])
+        with self.assertRaises(ValueError):
+            list(t.fuzzy('kitten', -1))
+
+    def _expected_top_k(self, pairs, prefix, k, score):
+        matching = [(key, value) for key, value in pairs.items()
+                    if key.startswith(prefix)]
+        matching.sort(key=lambda item: (-score(item[1]), item[0]))
+        return matching[:k]
+
+    def test_top_k(self):
+        def score(value):
+            return value % 37
+
+        rng = Random(4)
+        pairs = {}
+        t = TrieMap(compact=self.compact, score=score)
+        for key in self._keys:
+            pairs[key] = rng.randint(0, 1000)
+            t[key] = pairs[key]
+
+        # updates that both raise and lower scores, and deletions
+        for key in self._keys[:60]:
+            pairs[key] = rng.randint(0, 1000)
+            t[key] = pairs[key]
+        for key in self._keys[60:90]:
+            del pairs[key]
+            del t[key]
+        removed = t.delete_prefix('dd')
+        for key in [key for key in pairs if key.startswith('dd')]:
+            del pairs[key]
+            removed -= 1
+        self.assertEqual(removed, 0)
+
+        for prefix in ('', 'a', 'bc', 'cab', 'x'):
+            for k in (0, 1, 5, 1000):
+                self.assertEqual(t.top_k(prefix, k),
+                                 self._expected_top_k(pairs, prefix, k,
+                                                      score))
+
+        self.assertEqual(t.top_k('a', 3, key=lambda value: -value),
+                         self._expected_top_k(pairs, 'a', 3,
+                                              lambda value: -value))
+
+    def test_top_k_from_sorted(self):
+        pairs = sorted((key, len(key) * 10 + i % 7)
+                       for i, key in enumerate(self._keys))
+        t = TrieMap.from_sorted(pairs, compact=self.compact,
+                                score=lambda value: value)
+        self.assertEqual(t.top_k('b', 10),
+                         self._expected_top_k(dict(pairs), 'b', 10,
+                                              lambda value: value))
+
+    def test_top_k_needs_score(self):
+        with self.assertRaises(ValueError):
+            self._trie.top_k('a', 3)
+        self.assertEqual(len(self._trie.top_k('a', 3, key=lambda v: v)), 3)
+
+    def test_contains(self):
+        for key in self._keys:
+            self.assertTrue(key in self._trie)
+        for key in ('', 'x', 'abcdabcd'):
+            self.assertFalse(key in self._trie)
+
+    def _check_order_statistics(self, t, keys):
+        keys = sorted(keys)
+        self.assertEqual(len(t), len(keys))
+        for i, key in enumerate(keys):
+            self.assertEqual(t.select(i), key)
+            self.assertEqual(t.rank(key), i)
+        if keys:
+            self.assertEqual(t.select(-1), keys[-1])
+        with self.assertRaises(IndexError):
+            t.select(len(keys))
+
+        for probe in ('', 'a', 'abca', 'bb', 'c', 'dddddd', 'e'):
+            below = [key for key in keys if key < probe]
+            self.assertEqual(t.rank(probe), len(below))
+            self.assertEqual(t.count_prefix(probe),
+                             len([k for k in keys if k.startswith(probe)]))
+
+            above = [key for key in keys if key > probe]
+            if above:
+                self.assertEqual(t.successor(probe), above[0])
+            else:
+                with self.assertRaises(KeyError):
+                    t.successor(probe)
+            if below:
+                self.assertEqual(t.predecessor(probe), below[-1])
+            else:
+                with self.assertRaises(KeyError):
+                    t.predecessor(probe)
+
+    def test_failed_insert_keeps_counts(self):
+        for score in (None, len):
+            t = TrieMap(compact=self.compact, score=score)
+            t['ab'] = 'ab'
+            with self.assertRaises(TypeError):
+                t[('a', ['b'])] = 'ab'
+            self.assertEqual(len(t), 1)
+            self.assertEqual(list(t), ['ab'])
+            self.assertEqual(t.count_prefix('a'), 1)
+
+    def test_order_statistics(self):
+        keys = set(self._keys)
+        self._check_order_statistics(self._trie, keys)
+        for key in keys:
+            self._trie[key] = None   # overwriting leaves the counts alone
+        self._check_order_statistics(self._trie, keys)
+
+        for key in self._keys[:100]:
+            del self._trie[key]
+            keys.discard(key)
+        self._trie.delete_prefix('ab')
+        keys = set(key for key in keys if not key.startswith('ab'))
+        self._check_order_statistics(self._trie, keys)
+
+        t = TrieMap.from_sorted(((key, None) for key in sorted(keys)),
+                                compact=self.compact)
+        self._check_order_statistics(t, keys)
+
+        scored = TrieMap(compact=self.compact, score=len)
+        for key in keys:
+            scored[key] = key
+        self._check_order_statistics(scored, keys)
+
+    def test_range(self):
+        pairs = sorted((key, i) for i, key in enumerate(self._keys))
+        bounds = (None, '', 'a', 'abc', 'b', 'bca', 'cd', 'dddd', 'e')
+        for lo in bounds:
+            for hi in bounds:
+                expected = [(key, value) for key, value in pairs
+                            if (not lo or key >= lo) and
+                            (hi is None or key < hi)]
+                self.assertEqual(list(self._trie.range(lo, hi)), expected)
+
+    def test_pagination(self):
+        keys = sorted(self._keys)
+        for offset in (0, 50, 123, len(keys) - 1):
+            start = self._trie.select(offset)
+            page = [key for key, _ in islice(self._trie.range(start), 20)]
+            self.assertEqual(page, keys[offset:offset + 20])
+
+    def test_get_many(self):
+        rng = Random(6)
+        queries = list(self._keys[:100])
+        queries += [key + 'x' for key in self._keys[:20]]
+        queries += [key[:-1] for key in self._keys[:20]]
+        queries += ['', 'zzz', self._keys[0], self._keys[0]]
+        rng.shuffle(queries)
+
+        values = dict((key, i) for i, key in enumerate(self._keys))
+        expected = [values.get(key, 'missing') for key in queries]
+        self.assertEqual(self._trie.get_many(queries, 'missing'), expected)
+        self.assertEqual(self._trie.get_many(iter(queries)),
+                         [values.get(key) for key in queries])
+        self.assertEqual(self._trie.get_many([]), [])
+
+    def _num_nodes(self, trie):
+        stack = [trie._root]
+        num_nodes = 0
+        while stack:
+            node = stack.pop()
+            num_nodes += 1
+            stack.extend(node._children.values())
+
+        return num_nodes
+
+    def test_delete(self):
+        t = self._new_trie()
+        for key in ('a', 'abc', 'abd', 'b'):
+            t[key] = key
+
+        del t['abc']
+        self.assertEqual(list(t), ['a', 'abd', 'b'])
+        self.assertEqual(self._num_nodes(t), 5)
+
+        del t['abd']
+        self.assertEqual(list(t), ['a', 'b'])
+        self.assertEqual(self._num_nodes(t), 3)
+
+        del t['a']
+        del t['b']
+        self.assertEqual(len(t), 0)
+        self.assertEqual(self._num_nodes(t), 1)
+
+        t['ab'] = 1
+        for key in ('', 'a', 'abc', 'x'):
+            with self.assertRaises(KeyError):
+                del t[key]
+        self.assertEqual(t['ab'], 1)
+        self.assertEqual(len(t), 1)
+
+    def test_pop_and_clear(self):
+        key = self._keys[0]
+        self.assertEqual(self._trie.pop(key), 0)
+        self.assertEqual(len(self._trie), len(self._keys) - 1)
+        with self.assertRaises(KeyError):
+            self._trie.pop(key)
+        self.assertEqual(self._trie.pop(key, 'missing'), 'missing')
+        self.assertEqual(self._trie.pop('', None), None)
+
+        self._trie.clear()
+        self.assertEqual(len(self._trie), 0)
+        self.assertEqual(list(self._trie), [])
+        self.assertEqual(self._num_nodes(self._trie), 1)
+
+    def test_delete_prefix(self):
+        pairs = dict((key, i) for i, key in enumerate(self._keys))
+        for prefix in ('ab', 'c', 'dddd', 'x'):
+            removed = [key for key in pairs if key.startswith(prefix)]
+            self.assertEqual(self._trie.delete_prefix(prefix), len(removed))
+            for key in removed:
+                del pairs[key]
+
+            self.assertEqual(len(self._trie), len(pairs))
+            self.assertEqual(list(self._trie.items()), sorted(pairs.items()))
+
+        self.assertEqual(self._trie.delete_prefix(''), len(pairs))
+        self.assertEqual(len(self._trie), 0)
+        self.assertEqual(self._num_nodes(self._trie), 1)
+
+    def test_delete_prefix_prunes_parents(self):
+        t = self._new_trie()
+        t['abcd'] = 1
+        t['x'] = 2
+        self.assertEqual(t.delete_prefix('abc'), 1)
+        self.assertEqual(self._num_nodes(t), 2)
+
+    def _check_counts(self, t):
+        self.assertEqual(len(t), len(list(t)))
+        for key in list(t)[::7]:
+            self.assertEqual(t.count_prefix(key),
+                             len(list(t.with_prefix(key))))
+
+    def test_merge(self):
+        other_keys = _random_keys(300, seed=1)
+        other = self._new_trie()
+        for key in other_keys:
+            other[key] = -1
+
+        expected = dict(zip(self._keys, range(len(self._keys))))
+        for key in other_keys:
+            expected[key] = expected.get(key, 0) - 1
+
+        self._trie.merge(other, combine=lambda mine, theirs: mine + theirs)
+        self.assertEqual(list(self._trie.items()), sorted(expected.items()))
+        self.assertEqual(len(other), 0)
+        self.assertEqual(list(other), [])
+        self._check_counts(self._trie)
+
+        with self.assertRaises(ValueError):
+            self._trie.merge(self._trie)
+
+    def test_merge_moves_disjoint_subtrees(self):
+        a = self._new_trie()
+        a['abc'] = 1
+        b = self._new_trie()
+        b['abd'] = 2
+        b['xyz'] = 3
+        xyz = b._root._children['x']
+
+        a.merge(b)
+        self.assertIs(a._root._children['x'], xyz)
+        self.assertEqual(list(a.items()),
+                         [('abc', 1), ('abd', 2), ('xyz', 3)])
+        self.assertEqual(a.count_prefix('ab'), 2)
+
+    def test_merge_other_node_kind(self):
+        other = TrieMap(compact=not self.compact)
+        other['abd'] = 2
+        other['xyz'] = 3
+        self._trie.merge(other)
+        self.assertEqual(self._trie['xyz'], 3)
+        self.assertTrue(all(type(node) is self._trie._node_cls
+                            for node in self._trie._path_to('xyz')))
+        self._check_counts(self._trie)
+
+    def test_merge_scored(self):
+        a = TrieMap(compact=self.compact, score=lambda v: v)
+        a['apple'] = 5
+        a['apricot'] = 1
+        b = TrieMap(compact=self.compact, score=lambda v: -v)
+        b['avocado'] = 9
+        b['apricot'] = 7
+
+        a.merge(b, combine=max)
+        self.assertEqual(a.top_k('a', 2), [('avocado', 9), ('apricot', 7)])
+        self.assertEqual(a.top_k('ap', 1), [('apricot', 7)])
+
+    def test_merge_ranked_and_unranked(self):
+        def score(value):
+            return value
+
+        plain = TrieMap(compact=self.compact)
+        plain['apple'] = 5
+        ranked = TrieMap(compact=self.compact, score=score)
+        ranked['apricot'] = 7
+        plain.merge(ranked)
+        self.assertFalse(any(hasattr(node, '_best')
+                             for node in plain._path_to('apricot')))
+
+        ranked['avocado'] = 9
+        ranked.merge(plain)
+        self.assertEqual(ranked.top_k('a', 2),
+                         [('avocado', 9), ('apricot', 7)])
+
+        # Same score, other node kind: the bests are copied as they are.
+        other = TrieMap(compact=not self.compact, score=score)
+        other['banana'] = 8
+        ranked.merge(other)
+        self.assertEqual(ranked.top_k('', 2), [('avocado', 9), ('banana', 8)])
+
+    def test_intersection(self):
+        other_keys = _random_keys(300, seed=1)
+        other = self._new_trie()
+        for key in other_keys:
+            other[key] = 1000
+
+        self._trie.intersection(other, combine=lambda mine, theirs: mine)
+        expected = sorted((key, i) for i, key in enumerate(self._keys)
+                          if key in set(other_keys))
+        self.assertEqual(list(self._trie.items()), expected)
+        self.assertEqual(len(other), 300)
+        self._check_counts(self._trie)
+        self.assertEqual(self._num_nodes(self._trie),
+                         self._num_nodes(TrieMap.from_sorted(expected)))
+
+    def test_difference(self):
+        other_keys = _random_keys(300, seed=1)
+        other = self._new_trie()
+        for key in other_keys:
+            other[key] = 0
+
+        self._trie.difference(other)
+        expected = sorted((key, i) for i, key in enumerate(self._keys)
+                          if key not in set(other_keys))
+        self.assertEqual(list(self._trie.items()), expected)
+        self.assertEqual(len(other), 300)
+        self._check_counts(self._trie)
+        self.assertEqual(self._num_nodes(self._trie),
+                         self._num_nodes(TrieMap.from_sorted(expected)))
+
+        self._trie.difference(self._trie)
+        self.assertEqual(len(self._trie), 0)
+
+    def test_memory_is_flat_under_churn(self):
+        rng = Random(3)
+        live = set(self._keys)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            t = self._new_trie()
+            for key in live:
+                t[key] = key
+            footprint, _ = tracemalloc.get_traced_memory()
+
+            # 20k short-lived keys; if pruned nodes were kept this would be
+            # far larger than the live trie itself.
+            for _ in range(20000):
+                key = ''.join(rng.choice('abcdefgh')
+                              for _ in range(rng.randint(4, 10)))
+                if key not in live:
+                    t[key] = key
+                    del t[key]
+
+            gc.collect()
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(after - footprint, footprint // 4)
+        self.assertEqual(len(t), len(live))
+        self.assertEqual(self._num_nodes(t),
+                         self._num_nodes(TrieMap.from_sorted(
+                             (key, key) for key in sorted(live))))
+
+
+class TestCompactTrieMap(TestTrieMap):
+    compact = True
+
+    def test_compact_nodes(self):
+        self.assertTrue(self._trie.compact)
+        self.assertFalse(TrieMap().compact)
+        for node in (self._trie._root, self._trie._find_first_of('a')):
+            self.assertFalse(hasattr(node, '__dict__'))
+
+    def test_leaves_share_empty_children(self):
+        t = self._new_trie()
+        t['ab'] = 1
+        leaf = t._find_first_of('ab')
+        self.assertIs(leaf._children, _NO_CHILDREN)
+
+        t['abc'] = 2
+        self.assertEqual(len(leaf._children), 1)
+        self.assertEqual(t['ab'], 1)
+        self.assertEqual(t['abc'], 2)
@@ -1,10 +1,116 @@
+import asyncio
+from bisect import bisect_left
 from collections import deque
+from concurrent.futures import Future, as_completed   # noqa: F401
+from functools import partial
+from heapq import heapify, heappop, heappush
+from itertools import count, islice
+import logging
+import sys
 import threading
+import time
 from threading import Thread, Condition, Lock
 
+_logger = logging.getLogger("THREADPOOL")
 
-def _dummy():
-    return
+# Histogram buckets in seconds: 1us, 2us, 4us, ... ~36 minutes, then one
+# bucket for anything longer.
+_BUCKET_BOUNDS = [1e-6 * 2 ** i for i in range(32)]
+
+
+def _wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _run_chunk(fn, chunk):
+    return [fn(*args) for args in chunk]
+
+
+class _Histogram(object):
+    __slots__ = ('_count', '_total', '_max', '_buckets')
+
+    def __init__(self):
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds):
+        self._count += 1
+        self._total += seconds
+        if seconds > self._max:
+            self._max = seconds
+        self._buckets[bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+
+    def _percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of samples,
+        # capped at the largest sample seen.
+        rank = fraction * self._count
+        seen = 0
+        for bound, num in zip(_BUCKET_BOUNDS, self._buckets):
+            seen += num
+            if seen >= rank:
+                return min(bound, self._max)
+
+        return self._max
+
+    def snapshot(self):
+        bounds = _BUCKET_BOUNDS + [None]
+        return {
+            'count': self._count,
+            'sum': self._total,
+            'max': self._max,
+            'mean': self._total / self._count if self._count else 0.0,
+            'p50': self._percentile(0.5),
+            'p90': self._percentile(0.9),
+            'p99': self._percentile(0.99),
+            # (upper bound in seconds, count) for the non-empty buckets;
+            # None bounds the overflow bucket.
+            'buckets': [(bound, num) for bound, num
+                        in zip(bounds, self._buckets) if num],
+        }
+
+
+class _PoolMetrics(object):
+    # Counters and histograms for one pool, behind their own lock so
+    # recording never contends with the queue.
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = dict.fromkeys(
+            ('submitted', 'rejected', 'dropped', 'completed', 'failed',
+             'cancelled', 'expired'), 0)
+        self._max_queue_depth = 0
+        self._queue_wait = _Histogram()
+        self._run_time = _Histogram()
+
+    def record_submit(self, num_submitted, num_rejected, num_dropped,
+                      queue_depth):
+        with self._lock:
+            self._counters['submitted'] += num_submitted
+            self._counters['rejected'] += num_rejected
+            self._counters['dropped'] += num_dropped
+            if queue_depth > self._max_queue_depth:
+                self._max_queue_depth = queue_depth
+
+    def record_skipped(self, outcome):
+        with self._lock:
+            self._counters[outcome] += 1
+
+    def record_run(self, failed, queue_wait, run_time):
+        with self._lock:
+            self._counters['failed' if failed else 'completed'] += 1
+            self._queue_wait.add(queue_wait)
+            self._run_time.add(run_time)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['max_queue_depth'] = self._max_queue_depth
+            stats['queue_wait'] = self._queue_wait.snapshot()
+            stats['run_time'] = self._run_time.snapshot()
+            return stats
 
 
 class ThreadPoolError(Exception):
@@ -18,70 +124,655 @@ class ThreadPoolError(Exception):
         return "ThreadPoolError: {}".format(self._msg)
 
 
+class QueueFullError(ThreadPoolError):
+    # Raised by submit, or set on the futures of a batch, when the queue
+    # is full and the overload policy turns the job away.
+    pass
+
+
+class JobExpiredError(ThreadPoolError):
+    # Set on the future of a job whose deadline passed while it was still
+    # queued; the job itself never runs.
+    pass
+
+
 class ThreadPool(object):
 
     RUNNING = 1
     STOPPING = 2
     STOPPED = 3
 
-    def __init__(self, num_threads=4, queue_size=100):
+    # What submit does when the queue already holds queue_size jobs.
+    BLOCK = 'block'              # wait for room, up to block_timeout
+    REJECT = 'reject'            # raise QueueFullError
+    DROP_OLDEST = 'drop_oldest'  # cancel the oldest queued job
+    CALLER_RUNS = 'caller_runs'  # run the job in the submitting thread
+
+    def __init__(self, num_threads=4, queue_size=100, work_stealing=False,
+                 min_threads=None, max_threads=None, idle_timeout=60.0,
+                 scale_up_depth=1, scale_up_wait=None, aging=1.0,
+                 overload=BLOCK, block_timeout=None, metrics=False,
+                 before_job=None, after_job=None):
+        min_threads = num_threads if min_threads is None else min_threads
+        max_threads = max(num_threads, min_threads) if max_threads is None \
+            else max_threads
+        if not 0 <= min_threads <= max_threads or max_threads < 1:
+            raise ValueError("Need 0 <= min_threads <= max_threads and "
+                             "max_threads >= 1")
+        if queue_size is not None and queue_size < 1:
+            raise ValueError("queue_size must be at least 1, or None")
+        if overload not in (ThreadPool.BLOCK, ThreadPool.REJECT,
+                            ThreadPool.DROP_OLDEST, ThreadPool.CALLER_RUNS):
+            raise ValueError("Unknown overload policy {}".format(overload))
+
         self._status = ThreadPool.STOPPED
-        self._queue = deque()
         self._threads = {}   # thread id to thread
         self._lock = Lock()
         self._condition_not_full = Condition(self._lock)
         self._condition_not_empty = Condition(self._lock)
-        self._max_queue_size = 100
+        self._max_queue_size = sys.maxsize if queue_size is None \
+            else queue_size
+        self._overload = overload
+        self._block_timeout = block_timeout
         self._num_threads = num_threads
 
+        # Elastic sizing: start with min_threads workers and add one, up to
+        # max_threads, whenever scale_up_depth more jobs are queued than
+        # there are idle workers, or the oldest queued job has waited
+        # scale_up_wait seconds. Workers beyond min_threads retire after
+        # idle_timeout seconds without work. With scale_up_wait set, a
+        # monitor thread also checks the wait on a timer, since a pool
+        # whose workers are all busy may see no submit or pickup for long.
+        self._min_threads = min_threads
+        self._max_threads = max_threads
+        self._idle_timeout = idle_timeout
+        self._scale_up_depth = scale_up_depth
+        self._scale_up_wait = scale_up_wait
+        self._next_thread_name = 0
+        self._monitor = None
+        self._condition_monitor = Condition(self._lock)
+        # Shared mode with scale_up_wait: queued jobs in submission order,
+        # since the heap is ordered by priority rather than by age.
+        self._arrivals = deque()
+
+        # Queued jobs are (sort key, sequence number, future, job, args,
+        # enqueue time, deadline). The shared queue is a heap on the sort
+        # key, enqueue time + priority * aging: every aging seconds spent
+        # waiting is worth one priority level, so a low-priority job can be
+        # delayed but not starved, and the keys never need updating. With
+        # aging None priorities are strict. Equal keys run in submission
+        # order.
+        self._aging = aging
+        self._sequence = count()
+        self._queue = deque() if work_stealing else []
+
+        # Work-stealing mode: every worker owns a deque, and jobs submitted
+        # from outside the pool go to _queue. deque appends and pops are
+        # atomic, so none of these take the lock; it is only used to sleep
+        # when idle and to wait for room when full.
+        self._work_stealing = work_stealing
+        self._deques = []
+        self._num_idle = 0      # workers waiting for jobs
+        self._num_blocked = 0   # submitters waiting for room
+        self._worker = threading.local()   # deque of the current worker
+
+        # Coroutines waiting for room, as (loop, asyncio future); they are
+        # woken alongside the threads waiting on _condition_not_full.
+        self._room_waiters = deque()
+
+        # Instrumentation is opt in. Without it workers call the plain
+        # static _run_job and submit skips the bookkeeping, so the default
+        # path does no extra work at all. before_job(job) and
+        # after_job(job, error) run in the worker around every job.
+        self._metrics = _PoolMetrics() if metrics else None
+        self._before_job = before_job
+        self._after_job = after_job
+        if metrics or before_job is not None or after_job is not None:
+            self._run_job = self._run_job_instrumented
+
+    @property
+    def work_stealing(self):
+        return self._work_stealing
+
     @property
     def status(self):
         with self._lock:
             return self._status
 
-    def _run(self):
-        print("Thread {} starting to run"
-              .format(threading.current_thread().name))
+    @property
+    def queue_depth(self):
+        # Jobs waiting to run; read without the lock, so only a snapshot.
+        return self._num_queued()
 
-        while self.status != ThreadPool.STOPPED:
-            with self._lock:
+    @property
+    def overload(self):
+        return self._overload
 
-                while (len(self._queue) == 0 and
-                       self._status != ThreadPool.STOPPED):
+    @property
+    def size(self):
+        # Number of worker threads right now.
+        with self._lock:
+            return len(self._threads)
+
+    @property
+    def min_threads(self):
+        return self._min_threads
 
-                    print("Thread {} waiting for jobs"
-                          .format(threading.current_thread().name))
-                    self._condition_not_empty.wait()
+    @property
+    def max_threads(self):
+        return self._max_threads
+
+    def _spawn_worker(self):
+        # Called with the lock held.
+        name = str(self._next_thread_name)
+        self._next_thread_name += 1
+        if self._work_stealing:
+            own = deque()
+            self._deques = self._deques + [own]
+            t = Thread(name=name, target=self._run_stealing, args=(own,))
+        else:
+            t = Thread(name=name, target=self._run)
+        t.start()
+        self._threads[t.ident] = t
+
+    def _should_grow(self, num_queued):
+        if len(self._threads) >= self._max_threads:
+            return False
+
+        if num_queued - self._num_idle >= self._scale_up_depth:
+            return True
+
+        if self._scale_up_wait is not None:
+            oldest = self._oldest_enqueue_time()
+            return (oldest is not None and
+                    time.monotonic() - oldest >= self._scale_up_wait)
+
+        return False
+
+    def _oldest_enqueue_time(self):
+        # Called with the lock held; None if nothing is queued. Jobs that
+        # have since started, or were cancelled or dropped, are cleared
+        # from the front of _arrivals on the way.
+        if self._work_stealing:
+            return self._queue[0][5] if self._queue else None
+
+        arrivals = self._arrivals
+        while arrivals:
+            future = arrivals[0][2]
+            if not (future.running() or future.done()):
+                return arrivals[0][5]
+            arrivals.popleft()
+
+        return None
+
+    def _watch_queue_wait(self):
+        # The monitor thread: adds a worker, one per scale_up_wait, for as
+        # long as the oldest queued job has waited that long. With nothing
+        # queued it looks again every scale_up_wait seconds.
+        with self._lock:
+            while self._status == ThreadPool.RUNNING:
+                timeout = self._scale_up_wait
+                oldest = self._oldest_enqueue_time()
+                if oldest is not None:
+                    waited = time.monotonic() - oldest
+                    if waited < timeout:
+                        timeout -= waited
+                    elif len(self._threads) < self._max_threads:
+                        self._spawn_worker()
+                self._condition_monitor.wait(timeout)
+
+    def _wait_for_work(self, idle_since):
+        # Called with the lock held when there is nothing to run. Returns
+        # False if this worker should retire: it has been idle for
+        # idle_timeout and the pool is above min_threads.
+        if len(self._threads) > self._min_threads:
+            remaining = idle_since + self._idle_timeout - time.monotonic()
+            if remaining <= 0:
+                del self._threads[threading.get_ident()]
+                return False
+            self._condition_not_empty.wait(remaining)
+        else:
+            self._condition_not_empty.wait()
+
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle_since = time.monotonic()
+                self._num_idle += 1
+                retire = False
+                while (len(self._queue) == 0 and
+                       self._status == ThreadPool.RUNNING):
+                    if not self._wait_for_work(idle_since):
+                        retire = True
+                        break
+                self._num_idle -= 1
+
+                # A stopping pool still runs what was queued before stop().
+                if retire or len(self._queue) == 0:
+                    break
 
-                if self._status == ThreadPool.STOPPED:
+                item = heappop(self._queue)
+                self._notify_not_full()
+                if self._queue and self._should_grow(len(self._queue)):
+                    self._spawn_worker()
+
+            self._run_job(item)
+
+    def _next_item(self, own, others):
+        # The owner takes its newest job, which is the one most likely to
+        # be warm in cache; thieves take the oldest.
+        try:
+            return own.pop()
+        except IndexError:
+            pass
+
+        try:
+            return self._queue.popleft()
+        except IndexError:
+            pass
+
+        for victim in others:
+            try:
+                return victim.popleft()
+            except IndexError:
+                pass
+
+        return None
+
+    def _others(self, own):
+        deques = self._deques
+        # Empty deques compare equal, so own is found by identity.
+        index = next(i for i, d in enumerate(deques) if d is own)
+        return deques[index + 1:] + deques[:index]
+
+    def _run_stealing(self, own):
+        self._worker.deque = own
+        others = self._others(own)
+
+        while True:
+            item = self._next_item(own, others)
+            if item is None:
+                # Registering as idle before looking once more means a
+                # submitter either sees us idle and notifies, or appended
+                # early enough for that last look to find its job. Workers
+                # come and go, so the victims are looked up again too.
+                with self._lock:
+                    idle_since = time.monotonic()
+                    self._num_idle += 1
+                    try:
+                        while True:
+                            others = self._others(own)
+                            item = self._next_item(own, others)
+                            if (item is not None or
+                                    self._status != ThreadPool.RUNNING or
+                                    not self._wait_for_work(idle_since)):
+                                break
+                    finally:
+                        self._num_idle -= 1
+
+                    if item is None and self._status == ThreadPool.RUNNING:
+                        # Retiring; own is empty and only this thread adds
+                        # to it.
+                        self._deques = [d for d in self._deques
+                                        if d is not own]
+
+                if item is None:
                     break
 
-                assert len(self._queue) != 0
+            if self._num_blocked:
+                with self._lock:
+                    self._notify_not_full()
 
-                job = self._queue.popleft()
-                self._condition_not_full.notify()
+            if (len(self._threads) < self._max_threads and
+                    (own or self._queue)):
+                with self._lock:
+                    if (self._status == ThreadPool.RUNNING and
+                            self._should_grow(self._num_queued())):
+                        self._spawn_worker()
 
-                if (self._status == ThreadPool.STOPPING
-                        and len(self._queue) == 0):
-                    self._status = ThreadPool.STOPPED
+            self._run_job(item)
 
-            job()
+    def _num_queued(self):
+        return len(self._queue) + sum(len(d) for d in self._deques)
 
-        print("Stopping thread {}".format(threading.current_thread().name))
+    def _wake_stealing(self, num_jobs):
+        # Checked again under the lock, where workers decide to retire. A
+        # worker that was notified may not have woken yet, so growing is
+        # considered even when some are idle.
+        if self._num_idle or len(self._threads) < self._max_threads:
+            with self._lock:
+                if self._num_idle:
+                    self._condition_not_empty.notify(num_jobs)
+                if (self._status == ThreadPool.RUNNING and
+                        self._should_grow(self._num_queued())):
+                    self._spawn_worker()
 
-    def stop(self):
-        if self.status in (ThreadPool.STOPPING, ThreadPool.STOPPED):
+    def _wait_deadline(self):
+        if self._block_timeout is None:
+            return None
+
+        return time.monotonic() + self._block_timeout
+
+    def _enqueue_stealing(self, items, wait):
+        own = getattr(self._worker, 'deque', None)
+        if self._status != ThreadPool.RUNNING:
+            raise ThreadPoolError("Trying to submit jobs during pool shutdown")
+
+        if own is not None:
+            # Jobs spawned by a job stay with its worker, and never wait
+            # for room: a worker blocked on its own queue would deadlock.
+            own.extend(items)
+            self._wake_stealing(len(items))
+            return [], []
+
+        # The bound is checked without the lock, so concurrent submitters
+        # can overshoot it slightly.
+        evicted = []
+        wait_until = None
+        i = 0
+        while i < len(items):
+            room = self._max_queue_size - self._num_queued()
+            if room <= 0:
+                if self._overload == ThreadPool.DROP_OLDEST:
+                    # Only jobs on the shared queue can be dropped; if all
+                    # are in worker deques, overshoot instead.
+                    try:
+                        evicted.append(self._queue.popleft())
+                    except IndexError:
+                        pass
+                    room = 1
+                elif self._overload != ThreadPool.BLOCK or not wait:
+                    return items[i:], evicted
+                else:
+                    if wait_until is None:
+                        wait_until = self._wait_deadline()
+                    if not self._wait_for_room(wait_until):
+                        return items[i:], evicted
+                    continue
+
+            chunk = items[i:i + room]
+            self._queue.extend(chunk)
+            i += len(chunk)
+            self._wake_stealing(len(chunk))
+
+        return [], evicted
+
+    def _wait_for_room(self, wait_until):
+        # Work-stealing mode. Returns False if wait_until passed first.
+        with self._lock:
+            self._num_blocked += 1
+            try:
+                while (self._num_queued() >= self._max_queue_size and
+                       self._status == ThreadPool.RUNNING):
+                    if wait_until is None:
+                        self._condition_not_full.wait()
+                        continue
+
+                    remaining = wait_until - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition_not_full.wait(remaining)
+            finally:
+                self._num_blocked -= 1
+
+            if self._status != ThreadPool.RUNNING:
+                raise ThreadPoolError(
+                    "Trying to submit jobs during pool shutdown")
+
+        return True
+
+    def _notify_not_full(self):
+        # Called with the lock held whenever a queued job is taken.
+        self._condition_not_full.notify()
+        if self._room_waiters:
+            self._wake_room_waiter()
+
+    def _wake_room_waiter(self):
+        loop, waiter = self._room_waiters.popleft()
+        try:
+            loop.call_soon_threadsafe(_wake_waiter, waiter)
+        except RuntimeError:
+            pass   # the loop is closed; nobody is waiting any more
+
+    async def _wait_for_room_async(self, wait_until):
+        # _wait_for_room for coroutines: suspends rather than blocking the
+        # event loop. Returns False if wait_until passed first, True once
+        # the submit is worth retrying.
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        with self._lock:
+            if (self._num_queued() < self._max_queue_size or
+                    self._status != ThreadPool.RUNNING):
+                return True
+            self._room_waiters.append((loop, waiter))
+            self._num_blocked += 1
+
+        retry = False
+        try:
+            timeout = None
+            if wait_until is not None:
+                timeout = max(0, wait_until - time.monotonic())
+            await asyncio.wait_for(waiter, timeout)
+            retry = True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._num_blocked -= 1
+                try:
+                    self._room_waiters.remove((loop, waiter))
+                except ValueError:
+                    # Already woken. If cancelled or timed out meanwhile,
+                    # the wake goes to the next waiter, as in asyncio.Queue.
+                    if not retry and self._room_waiters:
+                        self._wake_room_waiter()
+
+        return True
+
+    def _remove_oldest(self):
+        # Called with the lock held on a full shared queue; the sequence
+        # number tells submission order apart from heap order.
+        queue = self._queue
+        i = min(range(len(queue)), key=lambda j: queue[j][1])
+        item = queue[i]
+        queue[i] = queue[-1]
+        queue.pop()
+        heapify(queue)
+        return item
+
+    def _enqueue_shared(self, items, wait):
+        evicted = []
+        wait_until = None
+        with self._lock:
+            i = 0
+            while i < len(items):
+                if self._status != ThreadPool.RUNNING:
+                    raise ThreadPoolError(
+                        "Trying to submit jobs during pool shutdown")
+
+                room = self._max_queue_size - len(self._queue)
+                if room <= 0:
+                    if self._overload == ThreadPool.DROP_OLDEST:
+                        evicted.append(self._remove_oldest())
+                        room = 1
+                    elif self._overload != ThreadPool.BLOCK or not wait:
+                        return items[i:], evicted
+                    else:
+                        if wait_until is None:
+                            wait_until = self._wait_deadline()
+                        if wait_until is None:
+                            self._condition_not_full.wait()
+                            continue
+
+                        remaining = wait_until - time.monotonic()
+                        if remaining <= 0:
+                            return items[i:], evicted
+                        self._condition_not_full.wait(remaining)
+                        continue
+
+                chunk = items[i:i + room]
+                for item in chunk:
+                    heappush(self._queue, item)
+                if self._scale_up_wait is not None:
+                    self._arrivals.extend(chunk)
+                i += len(chunk)
+                self._condition_not_empty.notify(len(chunk))
+                if self._should_grow(len(self._queue)):
+                    self._spawn_worker()
+
+        return [], evicted
+
+    def _submit_items(self, items, wait=True):
+        # Queues items under the overload policy; returns the ones turned
+        # away. Dropped and caller-run jobs are dealt with here, outside
+        # the lock, since both can run arbitrary callbacks. With wait
+        # false the BLOCK policy returns the overflow at once, for the
+        # caller to wait for room its own way and try again.
+        if self._work_stealing:
+            overflow, evicted = self._enqueue_stealing(items, wait)
+        else:
+            overflow, evicted = self._enqueue_shared(items, wait)
+
+        for item in evicted:
+            item[2].cancel()
+
+        if overflow and not wait and self._overload == ThreadPool.BLOCK:
+            return overflow
+
+        caller_runs = overflow and self._overload == ThreadPool.CALLER_RUNS
+        if self._metrics is not None:
+            num_rejected = 0 if caller_runs else len(overflow)
+            self._metrics.record_submit(len(items) - num_rejected,
+                                        num_rejected, len(evicted),
+                                        self._num_queued())
+
+        if caller_runs:
+            for item in overflow:
+                self._run_job(item)
+            return []
+
+        return overflow
+
+    def _make_item(self, job, args, priority, deadline, now):
+        if priority and self._work_stealing:
+            raise ValueError("Work-stealing pools do not support priorities")
+
+        key = priority if self._aging is None else now + priority * self._aging
+        return (key, next(self._sequence), Future(), job, args, now,
+                deadline)
+
+    @staticmethod
+    def _run_job(item):
+        # A failing job fails its future, never the worker thread.
+        _, _, future, job, args, _, deadline = item
+        if not future.set_running_or_notify_cancel():
+            return
+
+        if deadline is not None and time.monotonic() > deadline:
+            future.set_exception(JobExpiredError(
+                "Deadline passed while the job was queued"))
             return
 
+        try:
+            result = job(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run_job_instrumented(self, item):
+        # _run_job with metrics and hooks; only used when they are enabled.
+        _, _, future, job, args, enqueued, deadline = item
+        metrics = self._metrics
+        if not future.set_running_or_notify_cancel():
+            if metrics is not None:
+                metrics.record_skipped('cancelled')
+            return
+
+        start = time.monotonic()
+        if deadline is not None and start > deadline:
+            if metrics is not None:
+                metrics.record_skipped('expired')
+            future.set_exception(JobExpiredError(
+                "Deadline passed while the job was queued"))
+            return
+
+        error = None
+        try:
+            if self._before_job is not None:
+                self._before_job(job)
+            result = job(*args)
+        except BaseException as e:
+            error = e
+        end = time.monotonic()
+
+        if self._after_job is not None:
+            try:
+                self._after_job(job, error)
+            except Exception:
+                _logger.exception("after_job hook failed")
+
+        # Recorded before the future resolves, so a caller woken by the
+        # result already sees the job in stats().
+        if metrics is not None:
+            metrics.record_run(error is not None, start - enqueued,
+                               end - start)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        # Snapshot of the pool: current size, idle workers and queue depth
+        # always; with metrics=True also the job counters, the queue depth
+        # high-water mark and queue-wait and run-time histograms (seconds).
+        stats = {
+            'threads': len(self._threads),
+            'idle_threads': self._num_idle,
+            'queue_depth': self._num_queued(),
+        }
+        if self._metrics is not None:
+            stats.update(self._metrics.snapshot())
+
+        return stats
+
+    def stop(self):
+        # Lets the workers finish every job already queued, then joins
+        # them. Submitters still waiting for room are turned away.
         with self._lock:
+            if self._status != ThreadPool.RUNNING:
+                return
+
             self._status = ThreadPool.STOPPING
+            self._condition_not_empty.notify_all()
+            self._condition_not_full.notify_all()
+            self._condition_monitor.notify()
+            while self._room_waiters:
+                self._wake_room_waiter()
 
-            while self._status != ThreadPool.STOPPED:
-                self._queue.append(_dummy)
-                self._condition_not_empty.notify()
+        with self._lock:
+            threads = list(self._threads.values())
+            if self._monitor is not None:
+                threads.append(self._monitor)
+                self._monitor = None
 
-        for tid, t in self._threads:
-            t.join()
+        current = threading.current_thread()
+        for t in threads:
+            if t is not current:
+                t.join()
+
+        with self._lock:
+            self._status = ThreadPool.STOPPED
+
+            # In work-stealing mode a submit can race with stop() and land
+            # after the workers have gone; nothing will run those.
+            for queue in [self._queue] + self._deques:
+                while queue:
+                    queue.pop()[2].cancel()
+            self._arrivals.clear()
 
     def start(self):
         with self._lock:
@@ -94,27 +785,109 @@ class ThreadPool(object):
 
             self._status = ThreadPool.RUNNING
             self._threads = {}
-            for i in range(self._num_threads):
-                t = Thread(name=str(i), target=self._run)
-                t.start()
-                print("Started thread {}".format(t.name))
-                self._threads[t.ident] = t
-
-        print("Started")
-
-    def submit(self, job):
-        print("Submitting job")
-        if self.status in (ThreadPool.STOPPING, ThreadPool.STOPPED):
-            raise ThreadPoolError("Trying to submit jobs during pool shutdown")
-
-        print("Acquiring lock")
-        with self._lock:
-            print("Acquired lock")
-            while len(self._queue) == self._max_queue_size:
-                self._condition_not_full.wait()
-
-            assert len(self._queue) < self._max_queue_size
-
-            print("Adding job to queue")
-            self._queue.append(job)
-            self._condition_not_empty.notify()
+            self._deques = []
+            self._next_thread_name = 0
+            for _ in range(self._min_threads):
+                self._spawn_worker()
+            if self._scale_up_wait is not None:
+                self._monitor = Thread(name='monitor',
+                                       target=self._watch_queue_wait)
+                self._monitor.start()
+
+    def submit(self, job, *args, priority=0, deadline=None):
+        # Queues job(*args) and returns a concurrent.futures.Future for its
+        # result, so as_completed() and wait() work on it. Jobs with a
+        # smaller priority run first. If the job is still queued at
+        # deadline, a time.monotonic() value, its future fails with
+        # JobExpiredError instead.
+        item = self._make_item(job, args, priority, deadline,
+                               time.monotonic())
+        if self._submit_items([item]):
+            raise QueueFullError("Queue is full")
+
+        return item[2]
+
+    async def submit_async(self, job, *args, priority=0, deadline=None):
+        # submit for coroutines: returns an asyncio future for the result,
+        # completed on the calling event loop. With the BLOCK policy a
+        # full queue suspends the coroutine, for at most block_timeout
+        # seconds, instead of blocking the loop; the other policies act as
+        # in submit, so CALLER_RUNS runs the job on the loop thread.
+        # Cancelling the asyncio future cancels the job if still queued.
+        loop = asyncio.get_event_loop()
+        item = self._make_item(job, args, priority, deadline,
+                               time.monotonic())
+        wait_until = None
+        while self._submit_items([item], wait=False):
+            if self._overload == ThreadPool.BLOCK:
+                if wait_until is None:
+                    wait_until = self._wait_deadline()
+                if await self._wait_for_room_async(wait_until):
+                    continue
+                if self._metrics is not None:
+                    self._metrics.record_submit(0, 1, 0, self._num_queued())
+
+            raise QueueFullError("Queue is full")
+
+        return asyncio.wrap_future(item[2], loop=loop)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # stop() joins the workers, so it runs off the event loop.
+        await asyncio.get_event_loop().run_in_executor(None, self.stop)
+
+    def submit_batch(self, jobs, priority=0, deadline=None):
+        # Queues every job in jobs and returns their futures in order. The
+        # lock is taken once for each run of jobs that fits in the queue,
+        # not once per job. Jobs the overload policy turns away get a
+        # future failed with QueueFullError rather than an exception here,
+        # so the futures of the jobs that were queued are not lost.
+        now = time.monotonic()
+        items = [self._make_item(job, (), priority, deadline, now)
+                 for job in jobs]
+        for item in self._submit_items(items):
+            item[2].set_exception(QueueFullError("Queue is full"))
+
+        return [item[2] for item in items]
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1, ordered=True,
+            priority=0, deadline=None):
+        # Like the builtin map, but runs the calls on the pool. The calls
+        # are cut into chunks of chunksize, each run as a single job, and
+        # all submitted up front. Results come back in order, or chunk by
+        # chunk as they finish if ordered is false, waiting at most
+        # timeout seconds from this call in total. Chunks not yet started
+        # are cancelled if the caller stops early.
+        if chunksize < 1:
+            raise ValueError("chunksize must be at least 1")
+
+        end_time = None if timeout is None else time.monotonic() + timeout
+        args = zip(*iterables)
+        chunks = iter(lambda: list(islice(args, chunksize)), [])
+        futures = self.submit_batch([partial(_run_chunk, fn, chunk)
+                                     for chunk in chunks],
+                                    priority, deadline)
+
+        def remaining():
+            return None if end_time is None else end_time - time.monotonic()
+
+        def results():
+            pending = set(futures)
+            try:
+                if ordered:
+                    for future in futures:
+                        chunk_results = future.result(remaining())
+                        pending.discard(future)
+                        yield from chunk_results
+                else:
+                    for future in as_completed(futures, remaining()):
+                        pending.discard(future)
+                        yield from future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        return results()
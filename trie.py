@@ -1,4 +1,101 @@
-from collections import deque
+import gc
+import heapq
+import sys
+from bisect import bisect_left
+
+_NO_DEFAULT = object()
+
+# Ranges of at most this many sorted keys are finished key by key in
+# get_many().
+_GET_MANY_RANGE = 32
+
+
+def _common_prefix_length(a, b, start):
+    # Length of the common prefix of a and b, given that it is at least
+    # start. Binary search with startswith keeps the comparisons in C.
+    lo = start
+    hi = min(len(a), len(b))
+    if b.startswith(a[lo:hi], lo):
+        return hi
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if b.startswith(a[lo:mid], lo):
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+class _SortedChildren(object):
+    # Immutable char -> node mapping stored as a sorted string of edge
+    # characters and a parallel tuple of nodes. Far smaller than a dict for
+    # the one- and two-child nodes that make up most of a trie; str.find
+    # keeps lookups in C.
+    __slots__ = ('_chars', '_nodes')
+
+    def __init__(self, chars='', nodes=()):
+        self._chars = chars
+        self._nodes = nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._chars)
+
+    def __contains__(self, char):
+        return self._chars.find(char) >= 0
+
+    def __getitem__(self, char):
+        i = self._chars.find(char)
+        if i < 0:
+            raise KeyError(char)
+
+        return self._nodes[i]
+
+    def get(self, char, default=None):
+        i = self._chars.find(char)
+        return default if i < 0 else self._nodes[i]
+
+    def keys(self):
+        return list(self._chars)
+
+    def values(self):
+        return self._nodes
+
+    def items(self):
+        return zip(self._chars, self._nodes)
+
+    def with_child(self, char, node):
+        chars = self._chars
+        if not chars:
+            return _SortedChildren(char, (node,))
+
+        nodes = self._nodes
+        i = bisect_left(chars, char)
+        if i < len(chars) and chars[i] == char:
+            return _SortedChildren(chars, nodes[:i] + (node,) + nodes[i + 1:])
+
+        return _SortedChildren(chars[:i] + char + chars[i:],
+                               nodes[:i] + (node,) + nodes[i:])
+
+    def without_child(self, char):
+        chars = self._chars
+        i = chars.find(char)
+        if i < 0:
+            raise KeyError(char)
+
+        if len(chars) == 1:
+            return _NO_CHILDREN
+
+        nodes = self._nodes
+        return _SortedChildren(chars[:i] + chars[i + 1:],
+                               nodes[:i] + nodes[i + 1:])
+
+
+_NO_CHILDREN = _SortedChildren()
 
 
 class _TrieNode(object):
@@ -8,6 +105,7 @@ class _TrieNode(object):
         self._parent = None
         self._value = None
         self._terminal = False
+        self._count = 0      # number of keys in the subtree
 
     def __repr__(self):
         return ("[ [ char: {} ] "
@@ -48,31 +146,109 @@ class _TrieNode(object):
     def is_terminal(self):
         return self._terminal
 
-    def child_key_after(self, key_ord=0):
-        if len(self._children) == 0:
-            return None
+    def add_child(self, char):
+        child = type(self)(char)
+        child.parent = self
+        self._children[char] = child
+        return child
 
-        cur_min_ord = key_ord
-        for child_key in self._children:
-            child_key_ord = ord(child_key)
-            if child_key_ord <= key_ord:
-                continue
+    def attach_child(self, char, child):
+        child.parent = self
+        self._children[char] = child
 
-            if child_key_ord < cur_min_ord or cur_min_ord in (0, key_ord):
-                cur_min_ord = child_key_ord
+    def remove_child(self, char):
+        # Clearing the back pointer breaks the parent/child cycle, so a
+        # pruned leaf is freed by reference counting straight away.
+        child = self._children.pop(char)
+        child.parent = None
+        return child
 
-        assert cur_min_ord >= key_ord
 
-        return None if cur_min_ord == key_ord else chr(cur_min_ord)
+class _CompactTrieNode(object):
+    # No per-instance __dict__, no parent pointer, and children kept in a
+    # _SortedChildren instead of a dict.
+    __slots__ = ('_char', '_children', '_value', '_terminal', '_count')
+
+    def __init__(self, char):
+        self._char = char
+        self._children = _NO_CHILDREN
+        self._value = None
+        self._terminal = False
+        self._count = 0
+
+    def __repr__(self):
+        return ("[ [ char: {} ] "
+                "[ terminal: {} ] "
+                "[ value: {} ] "
+                "[ children: {} ] ]".format(self._char,
+                                            self._terminal,
+                                            self._value,
+                                            self._children.keys()))
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, val):
+        self._value = val
+
+    @property
+    def is_terminal(self):
+        return self._terminal
+
+    def add_child(self, char):
+        # Interning lets every edge with the same character share one
+        # string object, which matters for characters outside latin-1.
+        child = type(self)(sys.intern(char))
+        self._children = self._children.with_child(child._char, child)
+        return child
+
+    def attach_child(self, char, child):
+        self._children = self._children.with_child(char, child)
+
+    def remove_child(self, char):
+        child = self._children[char]
+        self._children = self._children.without_child(char)
+        return child
+
+
+class _RankedTrieNode(_TrieNode):
+    # Only ranked tries pay for the subtree summary.
+    def __init__(self, char):
+        super(_RankedTrieNode, self).__init__(char)
+        self._best = None    # best score in the subtree
+
+
+class _RankedCompactTrieNode(_CompactTrieNode):
+    __slots__ = ('_best',)
+
+    def __init__(self, char):
+        super(_RankedCompactTrieNode, self).__init__(char)
+        self._best = None
 
 
 class TrieMap(object):
-    def __init__(self):
-        self._root = _TrieNode('')
-        self._num_elements = 0
+    def __init__(self, compact=False, score=None):
+        # With a score function every node keeps the best score found in
+        # its subtree, which top_k() uses to search best first.
+        if compact:
+            self._node_cls = _CompactTrieNode if score is None \
+                else _RankedCompactTrieNode
+        else:
+            self._node_cls = _TrieNode if score is None else _RankedTrieNode
+        self._root = self._node_cls('')
+        self._score = score
+
+    @property
+    def compact(self):
+        return issubclass(self._node_cls, _CompactTrieNode)
 
     def __len__(self):
-        return self._num_elements
+        return self._root._count
+
+    def clear(self):
+        self._root = self._node_cls('')
 
     def __getitem__(self, key):
         if len(key) == 0:
@@ -92,7 +268,7 @@ class TrieMap(object):
 
         return cur_node.value
 
-    def __in__(self, key):
+    def __contains__(self, key):
         if len(key) == 0:
             return False
 
@@ -104,6 +280,52 @@ class TrieMap(object):
 
         return cur_node.is_terminal
 
+    def get_many(self, keys, default=None):
+        # Values for keys, in the order given, with default for misses.
+        # The keys are sorted and split into ranges; every key in a range
+        # shares the common prefix of its first and last key, so each range
+        # descends that prefix once and hands the node to its halves. Small
+        # ranges finish each key from there.
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        sorted_keys = [keys[i] for i in order]
+        results = [default] * len(keys)
+
+        stack = [(0, len(keys), self._root, 0)] if keys else []
+        while stack:
+            lo, hi, cur_node, depth = stack.pop()
+            first = sorted_keys[lo]
+            common = depth
+            if hi - lo > 1:
+                common = _common_prefix_length(first, sorted_keys[hi - 1],
+                                               depth)
+
+            for c in first[depth:common]:
+                cur_node = cur_node._children.get(c)
+                if cur_node is None:
+                    break
+            if cur_node is None:
+                continue
+
+            if hi - lo > _GET_MANY_RANGE:
+                mid = (lo + hi) // 2
+                stack.append((mid, hi, cur_node, common))
+                stack.append((lo, mid, cur_node, common))
+                continue
+
+            for i in range(lo, hi):
+                key = sorted_keys[i]
+                node = cur_node
+                for c in key[common:]:
+                    node = node._children.get(c)
+                    if node is None:
+                        break
+                else:
+                    if node._terminal and len(key) != 0:
+                        results[order[i]] = node._value
+
+        return results
+
     def _find_first_of(self, prefix=None):
         if prefix is None:
             return self._root
@@ -117,62 +339,40 @@ class TrieMap(object):
         assert cur_node is not None
         return cur_node
 
-    def _node_key(self, node):
-        key = deque()
-        while node is not self._root:
-            key.appendleft(node._char)
-            node = node.parent
-
-        return ''.join(key)
-
-    def _next_node(self, cur_node):
-        if cur_node is self._root:
-            if len(self._root._children) == 0:
-                return None
-
-            first_root_child_key = self._root.child_key_after(0)
-            return self._root._children[first_root_child_key]
-
-        if len(cur_node._children) != 0:
-            first_child_key = cur_node.child_key_after(0)
-            # print("First child key after 0 of node {} is {}"
-            #       .format(cur_node, first_child_key))
-            return cur_node._children[first_child_key]
-
-        # Move up the tree until we have a next available child or until we
-        # reach root node with no more children available for traversing.
-
-        while True:
-            cur_char = cur_node._char
-            parent = cur_node.parent
-            # get element in parent._children that follows cur_char
-            next_child_key_in_parent = parent.child_key_after(ord(cur_char))
-            if parent is self._root and next_child_key_in_parent is None:
-                return None   # no next element
-
-            if next_child_key_in_parent is None:
-                cur_node = parent
-                assert cur_node is not self._root
-                continue
-
-            # next child key in parent is not None
-            return parent._children[next_child_key_in_parent]
+    def _walk(self, node, prefix=''):
+        # Depth-first walk over the subtree rooted at node, yielding
+        # (key, node) for every terminal node in lexicographic order. The
+        # key is kept as a list of characters that grows and shrinks with
+        # the walk, so every node is visited once and every key is joined
+        # once.
+        path = list(prefix)
+        if node._terminal:
+            yield prefix, node
+
+        stack = [iter(sorted(node._children.items()))]
+        while stack:
+            for char, child in stack[-1]:
+                path.append(char)
+                if child._terminal:
+                    yield ''.join(path), child
+
+                if child._children:
+                    stack.append(iter(sorted(child._children.items())))
+                else:
+                    path.pop()
+                break
+            else:
+                stack.pop()
+                if stack:
+                    path.pop()
 
     def __iter__(self):
-        cur_node = self._root
-        while cur_node is not None:
-            if cur_node.is_terminal:
-                yield self._node_key(cur_node)
-
-            cur_node = self._next_node(cur_node)
+        for key, _ in self._walk(self._root):
+            yield key
 
     def items(self):
-        cur_node = self._root
-        while cur_node is not None:
-            if cur_node.is_terminal:
-                yield (self._node_key(cur_node), cur_node.value)
-
-            cur_node = self._next_node(cur_node)
+        for key, node in self._walk(self._root):
+            yield (key, node.value)
 
     def __str__(self):
         output = "{"
@@ -189,30 +389,569 @@ class TrieMap(object):
         if cur_node is None:
             return
 
-        while cur_node is not None:
-            if cur_node.is_terminal:
-                yield (self._node_key(cur_node), cur_node.value)
-
-            cur_node = self._next_node(cur_node)
+        for key, node in self._walk(cur_node, prefix or ''):
+            yield (key, node.value)
 
     def __setitem__(self, key, value):
         if len(key) == 0:
             raise KeyError("Key may not be empty")
 
-        cur_node = self._root
+        if self._score is not None:
+            self._set_scored(key, value)
+            return
+
+        # The counts are only touched once the walk has succeeded, so a
+        # key that cannot be stored leaves them as they were.
+        path = [self._root]
         for c in key:
-            child = cur_node._children.get(c)
+            child = path[-1]._children.get(c)
             if child is None:
-                new_node = _TrieNode(c)
-                new_node.parent = cur_node
-                cur_node._children[c] = new_node
-                cur_node = new_node
-                continue
-
-            cur_node = child
+                child = path[-1].add_child(c)
+            path.append(child)
 
+        cur_node = path[-1]
         if not cur_node._terminal:
-            self._num_elements += 1
+            for node in path:
+                node._count += 1
+
+        cur_node._terminal = True
+        cur_node.value = value
+
+    def _set_scored(self, key, value):
+        path = [self._root]
+        for c in key:
+            child = path[-1]._children.get(c)
+            if child is None:
+                child = path[-1].add_child(c)
+            path.append(child)
+
+        cur_node = path[-1]
+        old_score = None
+        if cur_node._terminal:
+            old_score = self._score(cur_node._value)
+        else:
+            for node in path:
+                node._count += 1
 
         cur_node._terminal = True
         cur_node.value = value
+
+        new_score = self._score(value)
+        if old_score is not None and new_score < old_score:
+            self._refresh_best(path)
+            return
+
+        for node in reversed(path):
+            if node._best is not None and node._best >= new_score:
+                break
+            node._best = new_score
+
+    def _node_best(self, node):
+        best = self._score(node._value) if node._terminal else None
+        for child in node._children.values():
+            if child._best is not None and (best is None or
+                                            child._best > best):
+                best = child._best
+
+        return best
+
+    def _refresh_best(self, path):
+        # Recomputes the subtree bests from the end of path upwards after a
+        # score went down or keys were removed. Once a node's best is
+        # unchanged, nothing above it can change either.
+        for node in reversed(path):
+            best = self._node_best(node)
+            if best == node._best:
+                break
+            node._best = best
+
+    def _rebuild_best(self, root=None):
+        nodes = [self._root if root is None else root]
+        i = 0
+        while i < len(nodes):
+            nodes.extend(nodes[i]._children.values())
+            i += 1
+
+        for node in reversed(nodes):
+            node._best = self._node_best(node)
+
+    def top_k(self, prefix, k, key=None):
+        # The k best-scoring (key, value) pairs under prefix, best first;
+        # equal scores come out in key order. Uses the per-node summaries
+        # when key is the trie's own score function, otherwise scores the
+        # whole subtree.
+        score = key if key is not None else self._score
+        if score is None:
+            raise ValueError("top_k needs a score function")
+
+        start = self._find_first_of(prefix)
+        if start is None or k <= 0:
+            return []
+
+        if score is not self._score:
+            return heapq.nsmallest(k, self.with_prefix(prefix),
+                                   key=lambda item: (-score(item[1]),
+                                                     item[0]))
+
+        # Entries are (-score, kind, key, node). A node entry (kind 0)
+        # carries the best score in its subtree, so no key still inside it
+        # can beat the entry; node entries sort before key entries (kind
+        # 1) so ties are expanded and then emitted in key order.
+        result = []
+        heap = []
+        if start._best is not None:
+            heap.append((-start._best, 0, prefix or '', start))
+        while heap and len(result) < k:
+            neg_score, kind, node_key, node = heapq.heappop(heap)
+            if kind == 1:
+                result.append((node_key, node._value))
+                continue
+
+            if node._terminal:
+                heapq.heappush(heap, (-score(node._value), 1, node_key, node))
+
+            for c, child in node._children.items():
+                if child._best is not None:
+                    heapq.heappush(heap, (-child._best, 0, node_key + c,
+                                          child))
+
+        return result
+
+    def prefixes_of(self, s):
+        # Every stored key that is a prefix of s, shortest first, found in
+        # one walk down the trie along s.
+        cur_node = self._root
+        for i, c in enumerate(s):
+            cur_node = cur_node._children.get(c)
+            if cur_node is None:
+                return
+
+            if cur_node._terminal:
+                yield (s[:i + 1], cur_node._value)
+
+    def longest_prefix(self, s, default=_NO_DEFAULT):
+        match_length = 0
+        match_node = None
+        cur_node = self._root
+        for i, c in enumerate(s):
+            cur_node = cur_node._children.get(c)
+            if cur_node is None:
+                break
+
+            if cur_node._terminal:
+                match_length = i + 1
+                match_node = cur_node
+
+        if match_node is None:
+            if default is _NO_DEFAULT:
+                raise KeyError("No key is a prefix of {}".format(s))
+            return default
+
+        return (s[:match_length], match_node._value)
+
+    def fuzzy(self, query, max_distance):
+        # Yields (key, value, distance) for every key within max_distance
+        # edits (Levenshtein) of query, in key order. Each visited node
+        # extends its parent's DP row by one character; a subtree is
+        # skipped as soon as no cell of the row is within the bound. Only
+        # the band of cells within max_distance of the diagonal can be in
+        # range, so a row keeps just that band, as (first column, cells),
+        # and everything above the bound is clamped to over.
+        if max_distance < 0:
+            raise ValueError("max_distance must not be negative")
+
+        over = max_distance + 1
+        width = len(query) + 1
+        first_row = (0, list(range(min(width, over))))
+        path = []
+        stack = [(c, child, 0, first_row) for c, child
+                 in sorted(self._root._children.items(), reverse=True)]
+        while stack:
+            char, node, depth, (prev_lo, prev_cells) = stack.pop()
+            del path[depth:]
+            path.append(char)
+
+            i = depth + 1
+            lo = i - max_distance if i > max_distance else 0
+            hi = min(width, i + over)
+            num_prev = len(prev_cells)
+            cells = []
+            best = left = over
+            for j in range(lo, hi):
+                if j == 0:
+                    dist = i
+                else:
+                    k = j - prev_lo   # the cell above; k - 1 is diagonal
+                    dist = prev_cells[k - 1] + (query[j - 1] != char)
+                    if k < num_prev and prev_cells[k] + 1 < dist:
+                        dist = prev_cells[k] + 1
+                    if left + 1 < dist:
+                        dist = left + 1
+                    if dist > over:
+                        dist = over
+                cells.append(dist)
+                left = dist
+                if dist < best:
+                    best = dist
+
+            if (node._terminal and hi == width and lo < hi and
+                    cells[-1] < over):
+                yield (''.join(path), node._value, cells[-1])
+
+            if node._children and best < over:
+                row = (lo, cells)
+                for c, child in sorted(node._children.items(), reverse=True):
+                    stack.append((c, child, i, row))
+
+    def count_prefix(self, prefix):
+        node = self._find_first_of(prefix)
+        return 0 if node is None else node._count
+
+    def rank(self, key):
+        # Number of stored keys that sort before key; key itself need not
+        # be stored.
+        rank = 0
+        cur_node = self._root
+        for c in key:
+            if cur_node._terminal:
+                rank += 1
+
+            next_node = None
+            for child_char, child in cur_node._children.items():
+                if child_char < c:
+                    rank += child._count
+                elif child_char == c:
+                    next_node = child
+
+            if next_node is None:
+                break
+            cur_node = next_node
+
+        return rank
+
+    def select(self, i):
+        # The key at position i in sorted order.
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Index {} out of range".format(i))
+
+        path = []
+        cur_node = self._root
+        while True:
+            if cur_node._terminal:
+                if i == 0:
+                    return ''.join(path)
+                i -= 1
+
+            for c, child in sorted(cur_node._children.items()):
+                if i < child._count:
+                    path.append(c)
+                    cur_node = child
+                    break
+                i -= child._count
+
+    def successor(self, key):
+        # Smallest stored key greater than key.
+        i = self.rank(key) + (1 if key in self else 0)
+        if i >= len(self):
+            raise KeyError("No key after {}".format(key))
+
+        return self.select(i)
+
+    def predecessor(self, key):
+        # Largest stored key smaller than key.
+        i = self.rank(key)
+        if i == 0:
+            raise KeyError("No key before {}".format(key))
+
+        return self.select(i - 1)
+
+    def _walk_from(self, lo):
+        # Like _walk over the whole trie, but starts at the first key >= lo
+        # after only descending along lo. The stack holds (char, node,
+        # depth) entries still to visit, next one last.
+        path = list(lo)
+        stack = []
+        cur_node = self._root
+        for depth, c in enumerate(lo):
+            next_node = None
+            for child_char, child in sorted(cur_node._children.items(),
+                                            reverse=True):
+                if child_char > c:
+                    stack.append((child_char, child, depth))
+                elif child_char == c:
+                    next_node = child
+
+            if next_node is None:
+                break
+            cur_node = next_node
+        else:
+            stack.append((lo[-1], cur_node, len(lo) - 1))
+
+        while stack:
+            char, node, depth = stack.pop()
+            del path[depth:]
+            path.append(char)
+            if node._terminal:
+                yield ''.join(path), node
+
+            for c, child in sorted(node._children.items(), reverse=True):
+                stack.append((c, child, depth + 1))
+
+    def range(self, lo=None, hi=None):
+        # (key, value) pairs with lo <= key < hi in key order; either bound
+        # may be None. Finding lo costs O(len(lo)), not its position.
+        if lo:
+            walk = self._walk_from(lo)
+        else:
+            walk = self._walk(self._root)
+
+        for key, node in walk:
+            if hi is not None and key >= hi:
+                return
+            yield (key, node._value)
+
+    def _path_to(self, key):
+        # Nodes from the root down to the node for key, or None if the key
+        # leaves the trie part way.
+        path = [self._root]
+        for c in key:
+            child = path[-1]._children.get(c)
+            if child is None:
+                return None
+            path.append(child)
+
+        return path
+
+    def _prune(self, path, key):
+        # Detach nodes that no longer lead to any key, walking back up from
+        # the end of path. path[i] is the node for key[:i].
+        depth = len(path) - 1
+        while depth > 0:
+            node = path[depth]
+            if node._terminal or node._children:
+                break
+
+            path[depth - 1].remove_child(key[depth - 1])
+            depth -= 1
+
+        if self._score is not None:
+            self._refresh_best(path[:depth + 1])
+
+    def pop(self, key, default=_NO_DEFAULT):
+        path = self._path_to(key) if len(key) != 0 else None
+        if path is None or not path[-1]._terminal:
+            if default is _NO_DEFAULT:
+                raise KeyError("Key {} not found.".format(key))
+            return default
+
+        node = path[-1]
+        value = node._value
+        node._terminal = False
+        node.value = None
+        for path_node in path:
+            path_node._count -= 1
+        self._prune(path, key)
+        return value
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def delete_prefix(self, prefix):
+        # Drops every key starting with prefix by detaching the subtree
+        # under it; returns the number of keys removed.
+        if not prefix:
+            num_removed = len(self)
+            self.clear()
+            return num_removed
+
+        path = self._path_to(prefix)
+        if path is None:
+            return 0
+
+        num_removed = path[-1]._count
+        path[-2].remove_child(prefix[-1])
+        path.pop()
+        for node in path:
+            node._count -= num_removed
+        self._prune(path, prefix)
+        return num_removed
+
+    def _adopt(self, parent, char, node, rescore):
+        # Hangs the subtree rooted at node, taken from another trie, under
+        # parent. Nodes of the same kind are moved as they are; otherwise
+        # the subtree is copied into nodes of this trie's kind. rescore
+        # recomputes the subtree bests, for tries scored differently.
+        if type(node) is not self._node_cls:
+            copy = parent.add_child(char)
+            stack = [(node, copy)]
+            while stack:
+                src, dst = stack.pop()
+                dst._terminal = src._terminal
+                dst._value = src._value
+                dst._count = src._count
+                if self._score is not None and not rescore:
+                    dst._best = src._best
+                for c, child in src._children.items():
+                    stack.append((child, dst.add_child(c)))
+            node = copy
+        else:
+            parent.attach_child(char, node)
+
+        if rescore:
+            self._rebuild_best(node)
+
+    def _recount(self, nodes):
+        # Fixes the subtree counts and bests of nodes, given in pre-order,
+        # from the bottom up, and drops children left without keys.
+        # Subtrees outside nodes are assumed to be correct already.
+        for node in reversed(nodes):
+            empty = [c for c, child in node._children.items()
+                     if child._count == 0]
+            for c in empty:
+                node.remove_child(c)
+
+            count = 1 if node._terminal else 0
+            for child in node._children.values():
+                count += child._count
+            node._count = count
+            if self._score is not None:
+                node._best = self._node_best(node)
+
+    def merge(self, other, combine=None):
+        # Moves every key of other into this trie, leaving other empty.
+        # Both tries are walked together only where they overlap; a subtree
+        # found in other alone is moved across whole. For keys in both, the
+        # value becomes combine(mine, theirs), or theirs without combine.
+        if other is self:
+            raise ValueError("Cannot merge a trie into itself")
+
+        rescore = self._score is not None and other._score is not self._score
+        visited = []
+        stack = [(self._root, other._root)]
+        while stack:
+            mine, theirs = stack.pop()
+            visited.append(mine)
+            if theirs._terminal:
+                if mine._terminal and combine is not None:
+                    mine._value = combine(mine._value, theirs._value)
+                else:
+                    mine._value = theirs._value
+                mine._terminal = True
+
+            for c, their_child in list(theirs._children.items()):
+                my_child = mine._children.get(c)
+                if my_child is None:
+                    self._adopt(mine, c, their_child, rescore)
+                else:
+                    stack.append((my_child, their_child))
+
+        self._recount(visited)
+        other.clear()
+
+    def intersection(self, other, combine=None):
+        # Keeps only the keys also in other, which is left unchanged.
+        # Subtrees missing from other are dropped whole. Values stay as
+        # they are unless combine is given, in which case they become
+        # combine(mine, theirs).
+        visited = []
+        stack = [(self._root, other._root)]
+        while stack:
+            mine, theirs = stack.pop()
+            visited.append(mine)
+            if mine._terminal:
+                if not theirs._terminal:
+                    mine._terminal = False
+                    mine._value = None
+                elif combine is not None:
+                    mine._value = combine(mine._value, theirs._value)
+
+            for c, my_child in list(mine._children.items()):
+                their_child = theirs._children.get(c)
+                if their_child is None:
+                    mine.remove_child(c)
+                else:
+                    stack.append((my_child, their_child))
+
+        self._recount(visited)
+
+    def difference(self, other):
+        # Removes every key that is also in other, which is left unchanged.
+        # Only the parts of other that overlap this trie are visited.
+        visited = []
+        stack = [(self._root, other._root)]
+        while stack:
+            mine, theirs = stack.pop()
+            visited.append(mine)
+            if theirs._terminal:
+                mine._terminal = False
+                mine._value = None
+
+            for c, their_child in theirs._children.items():
+                my_child = mine._children.get(c)
+                if my_child is not None:
+                    stack.append((my_child, their_child))
+
+        self._recount(visited)
+
+    @staticmethod
+    def from_sorted(pairs, compact=False, score=None, pause_gc=False):
+        # Builds a trie from (key, value) pairs in ascending key order.
+        # Consecutive keys share the nodes of their common prefix, so each
+        # edge is created once and nothing is looked up from the root.
+        # pairs is consumed lazily and may be a generator.
+        #
+        # The build allocates millions of long-lived nodes and frees none,
+        # so cyclic GC passes over them are pure overhead. pause_gc turns
+        # the collector off until the build is done. That is process wide:
+        # every other thread runs without cyclic GC meanwhile, including
+        # while pairs is being pulled from, so only ask for it when the
+        # input is already at hand.
+        gc_was_enabled = pause_gc and gc.isenabled()
+        if gc_was_enabled:
+            gc.disable()
+        try:
+            trie = TrieMap._build_sorted(pairs, compact, score)
+            if score is not None:
+                trie._rebuild_best()
+            return trie
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    @staticmethod
+    def _build_sorted(pairs, compact, score=None):
+        trie = TrieMap(compact=compact, score=score)
+        path = [trie._root]   # path[i] is the node for prev_key[:i]
+        prev_key = ''
+        for key, value in pairs:
+            if len(key) == 0:
+                raise KeyError("Key may not be empty")
+
+            if key < prev_key:
+                raise ValueError("Keys must be in sorted order: {} after {}"
+                                 .format(key, prev_key))
+
+            if key.startswith(prev_key):
+                common = len(prev_key)
+            else:
+                common = 0
+                while key[common] == prev_key[common]:
+                    common += 1
+                del path[common + 1:]
+
+            cur_node = path[-1]
+            for c in key[common:]:
+                cur_node = cur_node.add_child(c)
+                path.append(cur_node)
+
+            if not cur_node._terminal:
+                for node in path:
+                    node._count += 1
+
+            cur_node._terminal = True
+            cur_node.value = value
+            prev_key = key
+
+        return trie